@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys, os, getopt, time
+import glob
+import json
+import random
+import resource
+import shutil
+import tempfile
+import traceback
+import decipher as dc
+
+pathname = os.path.dirname(os.path.abspath(__file__))
+tests_directory = os.path.join(pathname,'../data/tests/')
+corpus_path = os.path.join(tests_directory,'test_quotes.txt')
+encrypted_pattern = os.path.join(tests_directory,'test_quotes.txt-*')
+output_path = None
+tolerance = 0.9
+random_seed = 1
+repeat = 3
+synthetic_lengths = [250, 1000, 4000]
+
+
+def peak_memory_kb():
+   """ Returns the peak resident memory of the process so far in kilobytes, as reported by linux
+   """
+   return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_forked(function):
+   """ Returns the result dictionary of the benchmark function run in a forked child process, with the
+   peak memory of the child above the memory it started with.  The child starts with the resident memory of
+   the process, the corpus included, so that is left out and each benchmark reports only what it adds
+   """
+   sys.stdout.flush()
+   sys.stderr.flush()
+   read_fd, write_fd = os.pipe()
+   pid = os.fork()
+   if pid == 0:
+      os.close(read_fd)
+      status = 1
+      try:
+         baseline_memory_kb = peak_memory_kb()
+         result = function()
+         result['peak_memory_kb'] = peak_memory_kb() - baseline_memory_kb
+         with os.fdopen(write_fd, 'w') as write_file:
+            json.dump(result, write_file)
+         status = 0
+      except BaseException:
+         traceback.print_exc()
+      finally:
+         sys.stdout.flush()
+         sys.stderr.flush()
+         os._exit(status)
+   os.close(write_fd)
+   with os.fdopen(read_fd) as read_file:
+      output = read_file.read()
+   status = os.waitpid(pid, 0)[1]
+   if status != 0:
+      raise RuntimeError('benchmark process failed with status %d' % status)
+   return json.loads(output)
+
+def time_call(function, repeat=1):
+   """ Returns the shortest time in seconds of repeat calls of the function
+   """
+   best = None
+   for i in range(repeat):
+      start_time = time.time()
+      function()
+      elapsed_time = time.time() - start_time
+      if best is None or elapsed_time < best: best = elapsed_time
+   return best
+
+def build_result(name, seconds, **values):
+   """ Returns dictionary of the result of a benchmark
+   """
+   result = {'name': name, 'seconds': seconds}
+   result.update(values)
+   return result
+
+def random_keys(number_of_keys, seed):
+   """ Returns list of random corpus alphabet lists
+   """
+   rng = random.Random(seed)
+   keys = []
+   for i in range(number_of_keys):
+      key = list(dc.UPPERCASE_ASCII)
+      rng.shuffle(key)
+      keys.append(key)
+   return keys
+
+def encrypt_text(text, seed):
+   """ Returns the text encrypted by a random simple substitution cypher, upper and lower case alike
+   """
+   key = random_keys(1, seed)[0]
+   return text.translate(dc.build_decrypt_map(list(dc.UPPERCASE_ASCII), key))
+
+def build_synthetic_texts(raw_text, lengths, seed):
+   """ Returns list of (length, encrypted text) tuples of stretches of the raw text of each length,
+   starting at a random word, the raw text is repeated if it is shorter than a length
+   """
+   rng = random.Random(seed)
+   starts = [i for i in range(len(raw_text)) if i == 0 or raw_text[i - 1].isspace()]
+   texts = []
+   for length in lengths:
+      repeated_text = raw_text * (length // max(len(raw_text), 1) + 2)
+      start = rng.choice(starts)
+      texts.append((length, encrypt_text(repeated_text[start:start + length], seed + length)))
+   return texts
+
+def find_encrypted_files(pattern):
+   return sorted(path for path in glob.glob(pattern) if not path.endswith('-decrypted'))
+
+def benchmark_text_functions(corpus_obj, repeat):
+   """ Returns results of timing normalize_text and divide_ngrams on the corpus text
+   """
+   def normalize_text():
+      seconds = time_call(lambda: dc.normalize_text(corpus_obj.raw_text), repeat)
+      return build_result('normalize_text', seconds, characters_per_second=len(corpus_obj.raw_text) / seconds)
+   def divide_ngrams():
+      seconds = time_call(lambda: dc.divide_ngrams(corpus_obj.normalized_text, 3), repeat)
+      return build_result('divide_ngrams', seconds, characters_per_second=len(corpus_obj.normalized_text) / seconds)
+   return [run_forked(normalize_text), run_forked(divide_ngrams)]
+
+def benchmark_scoring(corpus_obj, encrypted_text_obj, seed):
+   """ Returns results of timing score_decryption of random keys and the incremental scoring of random swaps
+   """
+   cypher_key_alphabet_list = encrypted_text_obj.letters_by_frequency
+   keys = random_keys(200, seed)
+   def score_decryption():
+      seconds = time_call(lambda: [dc.score_decryption(corpus_obj, encrypted_text_obj, dc.build_decrypt_map(cypher_key_alphabet_list, key)) for key in keys])
+      return build_result('score_decryption', seconds, keys_per_second=len(keys) / seconds)
+   def incremental_score_swap():
+      rng = random.Random(seed)
+      swaps = [tuple(rng.sample(range(len(cypher_key_alphabet_list)), 2)) for i in range(5000)]
+      scorer = dc.Incremental_Scorer(corpus_obj, encrypted_text_obj, cypher_key_alphabet_list, keys[0])
+      seconds = time_call(lambda: [scorer.score_swap(index1, index2) for index1, index2 in swaps])
+      return build_result('incremental_score_swap', seconds, keys_per_second=len(swaps) / seconds)
+   return [run_forked(score_decryption), run_forked(incremental_score_swap)]
+
+def benchmark_corpus(path, repeat):
+   """ Returns results of timing the build of the corpus and its binary cache, and the load of the cache
+   """
+   cache_directory = tempfile.mkdtemp()
+   try:
+      cache_path = os.path.join(cache_directory, 'corpus_cache.bin')
+      def corpus_build():
+         seconds = time_call(lambda: dc.Corpus(path, cache_path=cache_path), repeat)
+         return build_result('corpus_build', seconds, bytes_per_second=os.path.getsize(path) / seconds)
+      def corpus_cache_load():
+         return build_result('corpus_cache_load', time_call(lambda: dc.Corpus(path, use_cache=True, cache_path=cache_path), repeat))
+      results = [run_forked(corpus_build), run_forked(corpus_cache_load)]
+   finally:
+      shutil.rmtree(cache_directory)
+   return results
+
+def benchmark_solve(name, corpus_obj, encrypted_text_obj, tolerance, seed):
+   """ Returns result of timing a run_decryption_iterations solve, with the number of restarts it took
+   and the ratio of words found
+   """
+   tries = []
+   start_time = time.time()
+   decrypt_map = dc.run_decryption_iterations(encrypted_text_obj, corpus_obj, tolerance=tolerance, seed=seed,
+                                              progress=lambda try_number, decrypt_map, ratio: tries.append(try_number))
+   seconds = time.time() - start_time
+   ratio_of_words_found = dc.score_decryption(corpus_obj, encrypted_text_obj, decrypt_map)[1] if decrypt_map else None
+   return build_result(name, seconds, time_to_solve=seconds if decrypt_map else None, tries=len(tries),
+                       ratio_of_words_found=ratio_of_words_found, characters=len(encrypted_text_obj.raw_text))
+
+def run_benchmarks(corpus_path, encrypted_paths, lengths, tolerance=0.9, seed=1, repeat=3):
+   """ Returns dictionary of the benchmark results, see main
+
+   Parameters
+   ----------
+   corpus_path: string
+
+   encrypted_paths: list of strings, paths of encrypted files to solve
+
+   lengths: list of integers, lengths of the synthetic encrypted texts to solve
+
+   tolerance, seed: optional, see decipher.run_decryption_iterations
+
+   repeat: integer, optional
+   Number of times the fast benchmarks are repeated, the shortest time is reported
+   """
+   results = benchmark_corpus(corpus_path, repeat)
+   corpus_obj = dc.Corpus(corpus_path, cache_path=None, keep_text=True)
+   results += benchmark_text_functions(corpus_obj, repeat)
+   if encrypted_paths:
+      results += benchmark_scoring(corpus_obj, dc.Encrypted_Text(encrypted_paths[0]), seed)
+   for path in encrypted_paths:
+      results.append(run_forked(lambda: benchmark_solve('solve ' + os.path.basename(path), corpus_obj, dc.Encrypted_Text(path), tolerance, seed)))
+   for length, encrypted_text in build_synthetic_texts(corpus_obj.raw_text, lengths, seed):
+      results.append(run_forked(lambda: benchmark_solve('solve synthetic %d' % length, corpus_obj, dc.Encrypted_Text(None, encrypted_text), tolerance, seed)))
+   return {'python': sys.version.split()[0], 'numpy': dc.numpy is not None, 'corpus': corpus_path, 'time': time.time(),
+           'tolerance': tolerance, 'seed': seed, 'benchmarks': results}
+
+def main(argv):
+   """ Times the hot paths of decipher.py and full solves, and prints the results as json
+
+   Results list the seconds each benchmark took, rates such as keys_per_second, the time_to_solve of solves
+   (null if the tolerance was not reached) and the peak memory of each benchmark, which is run in its own
+   forked process, above the memory the process held when it started
+
+   Parameters, all optional
+   _______________________________________
+    -c <corpus_path>
+    The default is data/tests/test_quotes.txt
+
+    -e <encrypted_glob>
+    Encrypted files to solve, the default is data/tests/test_quotes.txt-*
+
+    -o <output_path>
+    Write the json results to a file instead of printing them
+
+    --lengths <n,n,...>
+    Lengths of synthetic encrypted texts, cut from the corpus, to solve.  The default is 250,1000,4000
+
+    --tolerance <ratio>
+    Ratio of words found that ends a solve, the default is 0.9
+
+    --seed <n>
+    Random seed, the default is 1
+
+    --repeat <n>
+    Number of times the fast benchmarks are repeated, the default is 3
+
+   """
+   global corpus_path, encrypted_pattern, output_path, synthetic_lengths, tolerance, random_seed, repeat
+   try:
+      opts, args = getopt.getopt(argv[1:], 'hc:e:o:', ["corpus=","encrypted=","output=","lengths=","tolerance=","seed=","repeat="])
+   except getopt.GetoptError:
+      print 'benchmark.py -c <corpus_path> -e <encrypted_glob> -o <output_path> --lengths <n,n,...>'
+      sys.exit(2)
+   for opt, arg in opts:
+      if opt == '-h':
+         print 'benchmark.py -c <corpus_path> -e <encrypted_glob> -o <output_path> --lengths <n,n,...>'
+         sys.exit()
+      elif opt in ("-c", "--corpus"):
+         corpus_path = arg
+      elif opt in ("-e", "--encrypted"):
+         encrypted_pattern = arg
+      elif opt in ("-o", "--output"):
+         output_path = arg
+      elif opt == "--lengths":
+         synthetic_lengths = [int(length) for length in arg.split(',') if length]
+      elif opt == "--tolerance":
+         tolerance = float(arg)
+      elif opt == "--seed":
+         random_seed = int(arg)
+      elif opt == "--repeat":
+         repeat = int(arg)
+
+   # decipher reports its progress on stdout, which is kept for the json results
+   stdout = sys.stdout
+   sys.stdout = sys.stderr
+   try:
+      results = run_benchmarks(corpus_path, find_encrypted_files(encrypted_pattern), synthetic_lengths, tolerance, random_seed, repeat)
+   finally:
+      sys.stdout = stdout
+   if output_path:
+      dc.write_json(results, output_path)
+   else:
+      print json.dumps(results, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
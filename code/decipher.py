@@ -1,15 +1,28 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import sys, os, getopt
+import sys, os, getopt, glob, time
+import multiprocessing
+import threading
+import Queue
 import re
 import random
 import string
-from collections import Counter, OrderedDict
+from collections import Counter, OrderedDict, namedtuple
 import json
 import math
 import codecs
 import traceback
+import mmap
+import struct
+import zlib
+import array
+import hashlib
+
+try:
+   import numpy
+except ImportError:
+   numpy = None
 
 pathname = os.path.dirname(os.path.abspath(__file__))
  
@@ -17,14 +30,109 @@ UPPERCASE_ASCII = unicode(string.ascii_uppercase)
 UPPERCASE_ASCII_SET = set(UPPERCASE_ASCII)
 LOWERCASE_ASCII = unicode(string.ascii_lowercase)
 LOWERCASE_ASCII_SET = set(LOWERCASE_ASCII)
+# normalized text only holds uppercase letters and spaces, these are encoded as 0-25 and 26 for the numpy backend
+NGRAM_ALPHABET = UPPERCASE_ASCII + u' '
+NGRAM_ALPHABET_INDEX = dict((letter, i) for i, letter in enumerate(NGRAM_ALPHABET))
+# words up to this length are encoded as base-27 integers that fit in an int64
+MAX_WORD_CODE_LENGTH = 13
+# binary corpus cache layout: a header, a table of named sections, then the sections
+CORPUS_CACHE_MAGIC = 'DCPHRBIN'
+CORPUS_CACHE_VERSION = 1
+# default bound on the size of the corpus caches kept by a Corpus_Registry
+CORPUS_CACHE_MAX_BYTES = 1 << 30
+# file of a Corpus_Registry directory mapping the size, modification time and inode of each corpus file to the
+# digest of its contents, so a corpus is only hashed again once it changes
+CORPUS_INDEX_NAME = 'corpus_index.json'
+# temporary files of a Corpus_Registry directory left unchanged for this many seconds are from writes that failed
+STALE_TEMPORARY_SECONDS = 3600
+CORPUS_CACHE_HEADER = struct.Struct('<8sII')
+CORPUS_CACHE_SECTION = struct.Struct('<16sQQ')
+# a corpus file can be cut before a word of ascii letters between ascii whitespace, see iter_corpus_pieces
+CLEAN_CUT_PATTERN = re.compile(ur'[ \t\n\r\f\v](?=[A-Za-z]+[ \t\n\r\f\v])')
+CLEAN_CUT_BYTES_PATTERN = re.compile(r'[ \t\n\r\f\v](?=[A-Za-z]+[ \t\n\r\f\v])')
+# default number of bytes read at a time when the corpus is streamed
+CORPUS_CHUNK_SIZE = 1 << 20
+# temperature schedule of the anneal search engine, temperatures are per ngram of log10 probability
+Annealing_Schedule = namedtuple('Annealing_Schedule', ['start_temperature', 'cooling_rate', 'steps_per_temperature', 'min_temperature'])
+DEFAULT_ANNEALING_SCHEDULE = Annealing_Schedule(0.02, 0.9, 500, 0.0005)
+# sizes of the ngrams a corpus can be scored by log probability with, see Corpus.build_ngram_log_probabilities
+NGRAM_SIZES = (2, 3, 4)
+# count added to the corpus count of every ngram when its log probability is estimated (additive smoothing),
+# so ngrams missing from the corpus get a small probability rather than none
+NGRAM_SMOOTHING_COUNT = 0.01
+# default number of keys whose scores are kept by the Score_Cache of a run
+SCORE_CACHE_SIZE = 100000
+# (word length, top N corpus words) of the candidate letters of each phase of decrypt, see build_decryption_tests
+DECRYPTION_TESTS = [(1,2),(2,30),(3,30),(4,200),(5,300)]
+# thresholds and budgets of a run of the search, see run_decryption_iterations.  tolerance is the ratio of words
+# found that ends the run and stop_ratio the one that ends a restart, max_tries the number of restarts,
+# decryption_tests the phase schedule of decrypt, max_evaluations and plateau_evaluations the number of
+# candidate keys a restart scores in all and without improving before it is cut off, and time_budget the
+# number of seconds the run may take.  None means no limit
+Search_Config = namedtuple('Search_Config', ['tolerance', 'stop_ratio', 'max_tries', 'decryption_tests', 'max_evaluations',
+                                             'plateau_evaluations', 'time_budget'])
+DEFAULT_SEARCH_CONFIG = Search_Config(0.98, 0.96, 200, DECRYPTION_TESTS, None, None, None)
+# cipher words shorter than this are left out of the word pattern key, see build_pattern_key
+MIN_PATTERN_WORD_LENGTH = 3
+# number of most frequent corpus words with a cipher word's letter pattern that build_pattern_key tries
+MAX_PATTERN_CANDIDATES = 50
+# profile of a text that a simple substitution cypher does not change, used to pick the corpus of an encrypted
+# text: the letter frequencies in decreasing order and the frequencies of the word lengths, see build_fingerprint
+Fingerprint = namedtuple('Fingerprint', ['letter_profile', 'word_length_profile'])
+# words longer than this are counted with words of this length in a Fingerprint
+MAX_FINGERPRINT_WORD_LENGTH = 15
+# default number of best matching corpora the search is run against when the corpus is selected by fingerprint
+SELECTED_CORPORA = 2
+# character classes of the text normalization, see Normalize_Table
+ASCII_WHITESPACE = u' \t\n\r\x0b\x0c'
+NONWORD_CHARACTERS = u'.:_0123456789'
+DROPPED_CHARACTERS = u"^-'\u2019"
+# each class is normalized to an ascii character of the class, so that normalizing it again leaves it as it is
+NORMALIZED_SEPARATOR = u' '
+NORMALIZED_RUN_SEPARATOR = u','
+NORMALIZED_DROPPED = u'-'
+NORMALIZED_DROPPED_SEPARATOR = u'\x1c'
+NORMALIZED_NONWORD = u'.'
+NON_ASCII_PATTERN = re.compile(u'[^\x00-\x7f]+')
+SEPARATOR_RUN_PATTERN = re.compile(' [ ,]+|,[ ,]*')
+NONWORD_TOKEN_PATTERN = re.compile(r'(?<![^ \x1c])[^ \x1c.]*\.[^ \x1c]*')
+# number of cipher words the progressive backend first scores swaps on, doubled each time fewer than
+# PROGRESSIVE_MIN_ACCEPTANCE of PROGRESSIVE_WINDOW proposed swaps are accepted, see Progressive_Scorer
+PROGRESSIVE_SAMPLE_SIZE = 500
+PROGRESSIVE_WINDOW = 1000
+PROGRESSIVE_MIN_ACCEPTANCE = 0.01
+# bound on the number of word lookups remembered by Mapped_Word_Counts
+MAX_WORD_LOOKUPS = 1000000
+# bound on the number of elements in the intermediate arrays of a batch of keys scored by Numpy_Scorer
+BATCH_ARRAY_SIZE = 4000000
 
 data_directory = os.path.join(pathname,'../data/')
 corpus_path = os.path.join(data_directory, 'corpus-en.txt')
 encrypted_text_path = os.path.join(data_directory,'encoded-en.txt')
 decrypted_text_path = os.path.join(data_directory,'decoded-en.txt')
 cipher_table_path = os.path.join(data_directory,'cipher-table.txt')
-corpus_cache_path = os.path.join(data_directory,'corpus_dict_cache.json')
-use_corpus_cache = False
+corpus_cache_directory = os.path.join(data_directory,'corpus_cache')
+corpus_cache_max_bytes = CORPUS_CACHE_MAX_BYTES
+corpus_selection = None
+number_of_selected_corpora = SELECTED_CORPORA
+scoring_backend = 'incremental'
+swap_block_size = 1
+number_of_workers = 1
+corpus_chunk_size = None
+corpus_build_workers = 1
+ngram_size = 3
+random_seed = None
+search_engine = 'hill_climb'
+annealing_schedule = DEFAULT_ANNEALING_SCHEDULE
+use_pattern_key = False
+batch_source = None
+batch_output_directory = os.path.join(data_directory, 'decoded')
+batch_state = None
+score_cache_size = SCORE_CACHE_SIZE
+trace_path = None
+search_config = DEFAULT_SEARCH_CONFIG
+decryption_state = None
+decryption_state_lock = threading.Lock()
 
 
 class Text(dict):
@@ -63,19 +171,14 @@ class Text(dict):
       and return as a list of strings
       """
 
-      list_of_words = re.split(ur'[\s\.\,\-]*', self.normalized_text, flags=re.UNICODE)
-      return list_of_words
+      # normalized text only holds uppercase letters and spaces, an empty text is one empty word
+      return self.normalized_text.split() or [u'']
 
    def build_letter_frequency_list(self):
       """  Return a list of letters in order of frequency in the text
       """
 
-      frequency_counter = Counter(list(self.normalized_text)).most_common()
-      letters_by_frequency = OrderedDict(frequency_counter).keys()
-      # this filters out punctuation, white spaces and numbers
-      letters_by_frequency = filter(lambda x: x in UPPERCASE_ASCII, letters_by_frequency)
-      missing_letters = list(build_missing_letters(''.join(letters_by_frequency)))
-      self.letters_by_frequency = letters_by_frequency + missing_letters
+      self.letters_by_frequency = build_letters_by_frequency(Counter(self.normalized_text))
    
    def divide_ngrams(self, n):
       """ Returns counter object 
@@ -101,19 +204,31 @@ class Corpus(Text):
    Corpus provides various methods for scoring relevance of other texts to the corpus
 
    """
-   def __init__(self, filepath, use_cache = False, cache_path = corpus_cache_path):
+   def __init__(self, filepath, use_cache = False, cache_path = None, chunk_size = None, build_workers = 1,
+                keep_text = False, ngram_size = 3):
       """ Read in the corpus and create the letter frequency list and fill the word count dictionary
+      The corpus is streamed in chunks unless keep_text is set, see read_corpus.  The other tables
+      (trigram arrays and ngram log probabilities, word indexes) are built or read from the cache on first use.
+      ngram_size, one of NGRAM_SIZES, is the size of the ngrams Log_Probability_Scorer scores by
+      cache_path is the binary corpus cache written after a build and read with use_cache.  It is not checked
+      against the corpus file, Corpus_Registry keeps caches under the hash of the corpus contents instead
       """
       self.filepath = filepath
+      self.raw_text = None
+      self.normalized_text = None
       self.total_count = 0
       self.corpus_dict = {}
       self.corpus_cache_path = cache_path
-      self.read_corpus(use_cache)
-      self.build_letter_frequency_list()
-
-      for word, count in self.corpus_dict.iteritems():
-         self[word] = int(count)
-         self.total_count += int(count)
+      self.corpus_cache = None
+      self.ngram_size = ngram_size
+      self.ngram_counts = {}
+      self.trigram_array = None
+      self.word_code_arrays = None
+      self.ngram_log_probabilities = {}
+      self.word_patterns = None
+      self.words_by_length = None
+      self.fingerprint = None
+      self.read_corpus(use_cache, chunk_size, build_workers, keep_text)
 
    def __call__(self, key):
       return self.score_one_word(self, key)
@@ -127,8 +242,9 @@ class Corpus(Text):
       key : string
       Word searched for in corpus and used to score
       """
-      if key in self:
-         return float(self[key]) * len(key) *len(key)
+      count = self.corpus_dict.get(key)
+      if count:
+         return float(count) * len(key) *len(key)
       else:
          return 0.0
 
@@ -137,7 +253,7 @@ class Corpus(Text):
       "Non-words" are removed in the Corpus version.  Especially important for removing urls and filenames
 
       """
-      self.normalized_text =  normalize_text(remove_nonwords(self.raw_text))
+      self.normalized_text =  normalize_corpus_piece(self.raw_text).strip()
       return True
 
    def score_word_list(self, word_list):
@@ -164,43 +280,163 @@ class Corpus(Text):
       for fragment in ngram_list:
          if self.trigrams.has_key(fragment):
             total += self.trigrams[fragment]
-      return  math.log10(0.0001+total/ len(ngram_list) )
+      return self.trigram_boost(total, len(ngram_list))
+
+   def trigram_boost(self, total, number_of_ngrams):
+      """ Returns the base-10 log score used by score_trigrams from an already summed trigram count
+
+      Parameters
+      ----------
+      total: integer
+      Sum of the corpus counts of the trigrams being scored
+
+      number_of_ngrams: integer
+      Number of trigrams that were summed
+      """
+      return  math.log10(0.0001+total/ number_of_ngrams )
+
+   def build_trigram_array(self):
+      """ Returns the trigram counts as a dense 27x27x27 numpy array indexed by encoded letters (see encode_text)
+      The array is built on first use and kept for later calls
+      """
+      if self.trigram_array is None and isinstance(self.trigrams, Mapped_Trigram_Counts):
+         self.trigram_array = self.trigrams.build_array()
+      if self.trigram_array is None:
+         trigram_array = numpy.zeros((len(NGRAM_ALPHABET),) * 3, dtype=numpy.int64)
+         for fragment, count in self.trigrams.iteritems():
+            if len(fragment) == 3 and all(letter in NGRAM_ALPHABET_INDEX for letter in fragment):
+               trigram_array[tuple(NGRAM_ALPHABET_INDEX[letter] for letter in fragment)] = count
+         self.trigram_array = trigram_array
+      return self.trigram_array
+
+   def build_ngram_log_probabilities(self, n=None):
+      """ Returns Ngram_Log_Probabilities of the ngrams of size n, the corpus ngram_size by default
+      The table is read from the corpus cache or built from the ngram counts on first use and kept for later calls
 
-   def read_corpus(self, use_cache=False):
+      Parameters
+      ----------
+      n: integer, optional
+      """
+      n = n or self.ngram_size
+      if n not in self.ngram_log_probabilities:
+         table = self.corpus_cache.read_ngram_table(n) if self.corpus_cache else None
+         if table is None: table = build_ngram_table(self.ngram_counts[n], n)
+         self.ngram_log_probabilities[n] = Ngram_Log_Probabilities(table, n)
+      return self.ngram_log_probabilities[n]
+
+   def build_fingerprint(self):
+      """ Returns Fingerprint of the corpus, see build_fingerprint
+      It is read from the corpus cache or built from the word counts on first use and kept for later calls
+      """
+      if self.fingerprint is None and self.corpus_cache:
+         self.fingerprint = self.corpus_cache.read_fingerprint()
+      if self.fingerprint is None:
+         self.fingerprint = build_fingerprint(self.corpus_dict)
+      return self.fingerprint
+
+   def build_word_patterns(self):
+      """ Returns Word_Index of the corpus words by letter pattern, see word_pattern
+      The index is read from the corpus cache or built on first use
+      """
+      if self.word_patterns is None and self.corpus_cache:
+         self.word_patterns = self.corpus_cache.read_word_index('pattern')
+      if self.word_patterns is None:
+         self.word_patterns = build_word_index(self.corpus_dict, word_pattern)
+      return self.word_patterns
+
+   def build_words_by_length(self):
+      """ Returns Word_Index of the corpus words by length
+      The index is read from the corpus cache or built on first use
+      """
+      if self.words_by_length is None and self.corpus_cache:
+         self.words_by_length = self.corpus_cache.read_word_index('length')
+      if self.words_by_length is None:
+         self.words_by_length = build_word_index(self.corpus_dict, len)
+      return self.words_by_length
+
+   def build_word_code_arrays(self):
+      """ Returns a tuple of 2 numpy arrays used to look up words encoded with word_code:
+          item 1: sorted array of the codes of corpus words of up to MAX_WORD_CODE_LENGTH letters
+          item 2: score_one_word score of each of those words
+      The arrays are built on first use and kept for later calls
+      """
+      if self.word_code_arrays is None:
+         coded_words = sorted((word_code(word), self.score_one_word(word)) for word in self.corpus_dict
+                              if len(word) <= MAX_WORD_CODE_LENGTH and UPPERCASE_ASCII_SET.issuperset(word))
+         codes = numpy.array([code for code, score in coded_words], dtype=numpy.int64)
+         scores = numpy.array([score for code, score in coded_words], dtype=numpy.float64)
+         self.word_code_arrays = (codes, scores)
+      return self.word_code_arrays
+
+   def read_corpus(self, use_cache=False, chunk_size=None, build_workers=1, keep_text=False):
       """ Reads the corpus, cleans and normalizes the text, and creates the corpus word counter dictionary, 
-          trigrams Counter.
-          If the use_cache flag is on values are read from the cache
+          trigrams Counter and letter frequency list.
+          If the use_cache flag is on values are read from the binary corpus cache, which is memory-mapped
+          and does not hold the corpus text, so raw_text and normalized_text are left as None
       
       Parameters
       ----------
       use_cache: Boolean
-      Default is False
-      """
-      if use_cache:
-         cache = read_json(self.corpus_cache_path)
-         self.raw_text = cache['raw_text']
-         self.normalized_text = cache['normalized_text']
-         self.trigrams = cache['trigrams']
-         text_dict = cache['text_dict'] 
-         self.corpus_dict = text_dict
+      Default is False.  Ignored when the corpus has no cache_path
+
+      chunk_size: integer, optional
+      The corpus is read and counted in chunks of about this many bytes, CORPUS_CHUNK_SIZE by default, and
+      the full text is never held in memory, so raw_text and normalized_text are left as None.  The counts
+      are the same as those of the whole text
+
+      build_workers: integer, optional
+      If more than 1 the corpus file is split at whitespace into shards that are normalized and counted
+      by that many processes, streaming in chunks as above, and the counts are merged.  The counts are the
+      same as those of the whole text
+
+      keep_text: Boolean, optional
+      If True and neither chunk_size nor build_workers is set, the whole text is read and raw_text and
+      normalized_text are kept
+      """
+      cache = read_corpus_cache(self.corpus_cache_path) if use_cache and self.corpus_cache_path else None
+      if cache and self.ngram_size != 3 and not cache.has_ngram_table(self.ngram_size):
+         # only the trigram counts are cached, so other ngrams have to be counted again
+         print 'corpus cache %s has no %d-gram table, rebuilding it' % (self.corpus_cache_path, self.ngram_size)
+         cache = None
+      if cache:
+         self.corpus_cache = cache
+         self.trigrams = cache.trigrams
+         self.ngram_counts = {3: self.trigrams}
+         self.corpus_dict = cache.corpus_dict
+         self.letters_by_frequency = cache.letters_by_frequency
+         self.total_count = cache.total_count
+      elif chunk_size or build_workers > 1 or not keep_text:
+         chunk_size = chunk_size or CORPUS_CHUNK_SIZE
+         if build_workers > 1:
+            boundaries = find_shard_boundaries(self.filepath, build_workers)
+            shards = [(self.filepath, chunk_size, start, end, (self.ngram_size,)) for start, end in zip(boundaries, boundaries[1:])]
+            pool = multiprocessing.Pool(build_workers)
+            try:
+               shard_counters = pool.map(count_corpus_shard, shards)
+            finally:
+               pool.terminate()
+            corpus_counter = Corpus_Counter((self.ngram_size,))
+            for shard_counter in shard_counters:
+               corpus_counter.merge(shard_counter)
+         else:
+            corpus_counter = count_corpus_shard((self.filepath, chunk_size, 0, None, (self.ngram_size,)))
+         corpus_counter.finish()
+         self.trigrams = corpus_counter.trigram_counts
+         self.ngram_counts = corpus_counter.ngram_counts
+         self.corpus_dict = dict(corpus_counter.word_counts)
+         self.total_count = sum(self.corpus_dict.itervalues())
+         self.letters_by_frequency = build_letters_by_frequency(corpus_counter.letter_counts)
+         if self.corpus_cache_path:  write_corpus_cache(self, self.corpus_cache_path)
       else:
-         cache = {}
          self.read_textfile()
          self.normalize_text()
          self.trigrams = self.divide_ngrams(3)
-         text_dict = {} 
-         text_list = self.split_into_words()
-         for word in text_list:
-            if text_dict.has_key(word):
-               text_dict[word] += 1
-            else:
-               text_dict[word] = 1
-         cache['trigrams'] = self.trigrams
-         cache['raw_text'] = self.raw_text 
-         cache['normalized_text'] = self.normalized_text
-         cache['text_dict'] = text_dict
-         if self.corpus_cache_path:  write_json(cache, self.corpus_cache_path)
-         self.corpus_dict = text_dict
+         self.ngram_counts = {3: self.trigrams}
+         if self.ngram_size != 3: self.ngram_counts[self.ngram_size] = self.divide_ngrams(self.ngram_size)
+         self.corpus_dict = dict(Counter(self.split_into_words()))
+         self.total_count = sum(self.corpus_dict.itervalues())
+         self.build_letter_frequency_list()
+         if self.corpus_cache_path:  write_corpus_cache(self, self.corpus_cache_path)
 
    def ratio_of_words_found(self, word_list):
       """ Returns a floating-point numeral, the ratio of words in the word list that are in the corpus
@@ -222,8 +458,10 @@ class Encrypted_Text(Text):
    
    Provides methods for translating the text as well as creating ngrams using translation table
    """
-   def __init__(self, path):
-      self.raw_text = None
+   def __init__(self, path, raw_text=None):
+      """ Read in the encrypted text file, or take the encrypted text from raw_text when it is given
+      """
+      self.raw_text = raw_text
       self.normalized_text = None
       self.list_of_strings = None
       self.filepath = path
@@ -231,9 +469,9 @@ class Encrypted_Text(Text):
       self.build_letter_frequency_list()
 
    def read_encrypted(self):
-      """ Reads in encrypted text file, normalizes text and creates list of encrypted words
+      """ Reads in encrypted text file unless the text was given, normalizes text and creates list of encrypted words
       """
-      self.read_textfile()
+      if self.raw_text is None: self.read_textfile()
       self.normalize_text()
       list_of_strings = self.split_into_words()
       list_of_strings.sort(key=len, reverse=False)
@@ -280,6 +518,457 @@ class Encrypted_Text(Text):
       return write_file(self.translate(translation_map), filepath, encoding="utf-8-sig")
       
 
+class Mapped_Trigram_Counts(object):
+   """ Read-only dict-like view of the trigram counts in a memory-mapped corpus cache
+
+   The counts are stored as a dense table of 27x27x27 little-endian unsigned 64-bit integers
+   indexed by the letters of the trigram encoded as in encode_text.  Counts that have been looked up are
+   kept in a dictionary, which holds at most 27x27x27 entries
+   """
+   def __init__(self, buffer, offset):
+      self.buffer = buffer
+      self.offset = offset
+      self.lookups = {}
+
+   def get(self, fragment, default=None):
+      count = self.lookups.get(fragment)
+      if count is None:
+         i = ngram_index(fragment) if len(fragment) == 3 else None
+         count = struct.unpack_from('<Q', self.buffer, self.offset + 8 * i)[0] if i is not None else 0
+         self.lookups[fragment] = count
+      return count if count else default
+
+   def __getitem__(self, fragment):
+      return self.get(fragment, 0)
+
+   def has_key(self, fragment):
+      return self.get(fragment, 0) > 0
+
+   __contains__ = has_key
+
+   def iteritems(self):
+      counts = struct.unpack_from('<%dQ' % len(NGRAM_ALPHABET) ** 3, self.buffer, self.offset)
+      for i, count in enumerate(counts):
+         if count:
+            yield NGRAM_ALPHABET[i // len(NGRAM_ALPHABET) ** 2] + NGRAM_ALPHABET[i // len(NGRAM_ALPHABET) % len(NGRAM_ALPHABET)] + NGRAM_ALPHABET[i % len(NGRAM_ALPHABET)], count
+
+   def build_array(self):
+      """ Returns the counts as a 27x27x27 numpy array backed by the memory map
+      """
+      return numpy.frombuffer(self.buffer, dtype='<u8', count=len(NGRAM_ALPHABET) ** 3, offset=self.offset).reshape((len(NGRAM_ALPHABET),) * 3)
+
+class Ngram_Log_Probabilities(object):
+   """ Read-only dict-like view of a dense table of ngram log probabilities, see build_ngram_table
+
+   Log probabilities that have been looked up are kept in a dictionary, which holds at most 27**n entries
+   """
+   def __init__(self, table, n):
+      self.table = table
+      self.n = n
+      self.lookups = {}
+
+   def get(self, fragment, default=None):
+      log_probability = self.lookups.get(fragment)
+      if log_probability is None:
+         i = ngram_index(fragment) if len(fragment) == self.n else None
+         if i is None: return default
+         log_probability = self.lookups[fragment] = self.table[i]
+      return log_probability
+
+   def __getitem__(self, fragment):
+      log_probability = self.get(fragment)
+      if log_probability is None: raise KeyError(fragment)
+      return log_probability
+
+class Mapped_Word_Counts(object):
+   """ Read-only dict-like view of the word counts in a memory-mapped corpus cache
+
+   Words are stored as one utf-8 blob with an array of start offsets and an array of counts, and are found
+   through an open-addressing hash table of word numbers keyed by the crc32 of the word.  The results of
+   lookups are kept in a dictionary of at most MAX_WORD_LOOKUPS entries, since the search looks up the
+   same words many times
+   """
+   def __init__(self, buffer, word_offsets, words, word_counts, hash_table, number_of_words, hash_table_size):
+      self.lookups = {}
+      self.buffer = buffer
+      self.word_offsets = word_offsets
+      self.words = words
+      self.word_counts = word_counts
+      self.hash_table = hash_table
+      self.number_of_words = number_of_words
+      self.hash_table_size = hash_table_size
+
+   def word(self, i):
+      start, end = struct.unpack_from('<2I', self.buffer, self.word_offsets + 4 * i)
+      return self.buffer[self.words + start:self.words + end]
+
+   def count(self, i):
+      return struct.unpack_from('<I', self.buffer, self.word_counts + 4 * i)[0]
+
+   def find(self, word):
+      """ Returns the number of the word in the cache, None if it is not there
+      """
+      try:
+         return self.lookups[word]
+      except KeyError:
+         if len(self.lookups) >= MAX_WORD_LOOKUPS: self.lookups.clear()
+         i = self.lookups[word] = self.find_in_table(word)
+         return i
+
+   def find_in_table(self, word):
+      if isinstance(word, unicode): word = word.encode('utf-8')
+      slot = zlib.crc32(word) & (self.hash_table_size - 1)
+      while True:
+         i = struct.unpack_from('<I', self.buffer, self.hash_table + 4 * slot)[0]
+         if not i: return None
+         if self.word(i - 1) == word: return i - 1
+         slot = (slot + 1) & (self.hash_table_size - 1)
+
+   def get(self, word, default=None):
+      i = self.find(word)
+      return default if i is None else self.count(i)
+
+   def __getitem__(self, word):
+      i = self.find(word)
+      if i is None: raise KeyError(word)
+      return self.count(i)
+
+   def has_key(self, word):
+      return self.find(word) is not None
+
+   __contains__ = has_key
+
+   def __len__(self):
+      return self.number_of_words
+
+   def iterkeys(self):
+      for i in range(self.number_of_words):
+         yield self.word(i).decode('utf-8')
+
+   __iter__ = iterkeys
+
+   def keys(self):
+      return list(self.iterkeys())
+
+   def iteritems(self):
+      for i in range(self.number_of_words):
+         yield self.word(i).decode('utf-8'), self.count(i)
+
+   def itervalues(self):
+      for i in range(self.number_of_words):
+         yield self.count(i)
+
+class Word_Index(dict):
+   """ Word_Index inherits from the built-in dict class, it maps keys such as word lengths or letter patterns
+   to lists of the corpus words with that key, most frequent first.  See build_word_index
+   """
+   def get(self, key, default=None, top_n=None):
+      """ Returns the list of words of the key, only the first top_n if top_n is set
+      """
+      words = dict.get(self, key, default)
+      return words[:top_n] if top_n and words is not None else words
+
+class Mapped_Word_Index(object):
+   """ Read-only view of a Word_Index in a memory-mapped corpus cache
+
+   The keys are kept in a dictionary of their start and end in an array of word numbers, the words of
+   a key are read from the word counts of the cache when they are asked for, so getting the top_n words
+   of a key costs O(top_n) whatever the size of the corpus.  Keys are stored as unicode strings
+   """
+   def __init__(self, buffer, key_table, key_words, word_counts):
+      self.buffer = buffer
+      self.key_table = key_table
+      self.key_words = key_words
+      self.word_counts = word_counts
+
+   def get(self, key, default=None, top_n=None):
+      key = unicode(key)
+      if key not in self.key_table: return default
+      start, end = self.key_table[key]
+      if top_n: end = min(end, start + top_n)
+      word_numbers = struct.unpack_from('<%dI' % (end - start), self.buffer, self.key_words + 4 * start)
+      return [self.word_counts.word(i).decode('utf-8') for i in word_numbers]
+
+   def __getitem__(self, key):
+      words = self.get(key)
+      if words is None: raise KeyError(key)
+      return words
+
+   def has_key(self, key):
+      return unicode(key) in self.key_table
+
+   __contains__ = has_key
+
+   def __len__(self):
+      return len(self.key_table)
+
+class Corpus_Cache(object):
+   """ Corpus_Cache holds the memory-mapped tables of a binary corpus cache written by write_corpus_cache
+
+   Sections are looked up by name in the section table of the file, so sections can be added without
+   breaking older readers
+   """
+   def __init__(self, path):
+      with open(path, 'rb') as cache_file:
+         self.buffer = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+      magic, version, number_of_sections = CORPUS_CACHE_HEADER.unpack_from(self.buffer, 0)
+      if magic != CORPUS_CACHE_MAGIC or version != CORPUS_CACHE_VERSION:
+         raise ValueError('%s is not a version %d corpus cache' % (path, CORPUS_CACHE_VERSION))
+      self.sections = {}
+      for i in range(number_of_sections):
+         name, offset, length = CORPUS_CACHE_SECTION.unpack_from(self.buffer, CORPUS_CACHE_HEADER.size + i * CORPUS_CACHE_SECTION.size)
+         self.sections[name.rstrip('\0')] = (offset, length)
+      self.meta = json.loads(self.section('meta'))
+      self.total_count = self.meta['total_count']
+      self.letters_by_frequency = list(self.section('letters').decode('ascii'))
+      self.trigrams = Mapped_Trigram_Counts(self.buffer, self.sections['trigrams'][0])
+      self.corpus_dict = Mapped_Word_Counts(self.buffer, self.sections['word_offsets'][0], self.sections['words'][0],
+                                            self.sections['word_counts'][0], self.sections['word_hash_table'][0],
+                                            self.meta['number_of_words'], self.meta['hash_table_size'])
+
+   def read_word_index(self, name):
+      """ Returns Mapped_Word_Index of the word index sections of the name, None if the cache has none,
+      as caches written before the word indexes were added do not
+      """
+      if name + '_table' not in self.sections: return None
+      return Mapped_Word_Index(self.buffer, json.loads(self.section(name + '_table')), self.sections[name + '_words'][0], self.corpus_dict)
+
+   def read_fingerprint(self):
+      """ Returns Fingerprint of the corpus, None if the cache has none, as caches written before the
+      fingerprints were added do not
+      """
+      if 'fingerprint' not in self.sections: return None
+      return Fingerprint(**json.loads(self.section('fingerprint')))
+
+   def has_ngram_table(self, n):
+      return 'ngrams%d' % n in self.sections
+
+   def read_ngram_table(self, n):
+      """ Returns array of the ngram log probabilities of the ngrams of size n, see build_ngram_table,
+      None if the cache has none, as caches written before the tables were added do not
+      """
+      if not self.has_ngram_table(n): return None
+      table = array.array('d', self.section('ngrams%d' % n))
+      if sys.byteorder == 'big': table.byteswap()
+      return table
+
+   def section(self, name):
+      """ Returns the bytes of a section
+      """
+      offset, length = self.sections[name]
+      return self.buffer[offset:offset + length]
+
+class Corpus_Registry(object):
+   """ Corpus_Registry keeps the binary caches of any number of corpora in a directory
+
+   Each cache is stored under the key of corpus_cache_key, so a corpus is read from its cache whenever
+   its source file and build settings are unchanged and is built and cached otherwise.  The digests of the
+   corpus files are kept in an index, see file_digest, so a warm load does not read the corpus.  Once the caches
+   take more than max_bytes the least recently used ones are removed.  If max_bytes is 0 corpora are
+   built without being cached
+   """
+   def __init__(self, directory=corpus_cache_directory, max_bytes=CORPUS_CACHE_MAX_BYTES):
+      self.directory = directory
+      self.max_bytes = max_bytes
+
+   def cache_path(self, filepath, ngram_size=3):
+      return os.path.join(self.directory, corpus_cache_key(filepath, ngram_size, self.file_digest(filepath)) + '.bin')
+
+   def file_digest(self, filepath):
+      """ Returns the corpus_file_digest of the corpus file, taken from the index of the directory while the
+      size, modification time and inode of the file are those it was hashed with
+      """
+      stat = os.stat(filepath)
+      signature = [stat.st_size, stat.st_mtime, stat.st_ino]
+      index_path = os.path.join(self.directory, CORPUS_INDEX_NAME)
+      try:
+         with open(index_path) as index_file:
+            index = json.load(index_file)
+      except (IOError, ValueError):
+         index = {}
+      entry = index.get(os.path.realpath(filepath))
+      if entry and entry[:3] == signature: return entry[3]
+      digest = corpus_file_digest(filepath)
+      index = dict((path, entry) for path, entry in index.iteritems() if os.path.exists(path))
+      index[os.path.realpath(filepath)] = signature + [digest]
+      if os.path.isdir(self.directory):
+         # written under a temporary name and renamed, as the caches are, for processes sharing the directory
+         temporary_path = '%s.%d.tmp' % (index_path, os.getpid())
+         try:
+            with open(temporary_path, 'w') as index_file:
+               json.dump(index, index_file)
+            os.rename(temporary_path, index_path)
+         except (IOError, OSError):
+            if os.path.exists(temporary_path): os.remove(temporary_path)
+      return digest
+
+   def load(self, filepath, chunk_size=None, build_workers=1, ngram_size=3):
+      """ Returns Corpus object of the corpus file, read from its cache if the registry has one
+
+      Parameters
+      ----------
+      filepath: string
+
+      chunk_size, build_workers, ngram_size: optional, see Corpus
+      """
+      if not self.max_bytes:
+         return Corpus(filepath, cache_path=None, chunk_size=chunk_size, build_workers=build_workers, ngram_size=ngram_size)
+      make_dir(self.directory)
+      path = self.cache_path(filepath, ngram_size)
+      corpus_obj = Corpus(filepath, os.path.exists(path), cache_path=path, chunk_size=chunk_size,
+                          build_workers=build_workers, ngram_size=ngram_size)
+      # the modification time of a cache is the time it was last used
+      if os.path.exists(path): os.utime(path, None)
+      self.evict(keep=path)
+      return corpus_obj
+
+   def evict(self, keep=None):
+      """ Removes the least recently used caches until the caches take at most max_bytes, except the cache
+      at path keep, and the stale temporary files of failed writes.  Returns list of the paths removed
+      """
+      removed = []
+      for path in glob.glob(os.path.join(self.directory, '*.tmp')):
+         try:
+            if time.time() - os.path.getmtime(path) < STALE_TEMPORARY_SECONDS: continue
+            os.remove(path)
+         except OSError:
+            continue
+         removed.append(path)
+      caches = [(os.path.getmtime(path), os.path.getsize(path), path) for path in glob.glob(os.path.join(self.directory, '*.bin'))]
+      total = sum(size for mtime, size, path in caches)
+      for mtime, size, path in sorted(caches):
+         if total <= self.max_bytes: break
+         if path == keep: continue
+         try:
+            os.remove(path)
+         except OSError:
+            continue
+         total -= size
+         removed.append(path)
+      return removed
+
+class Corpus_Counter(object):
+   """ Counts the words, ngrams and letters of a normalized text that is fed in consecutive segments
+
+   The counts are those of the stripped concatenation of the segments, as Corpus.read_corpus would count
+   the whole normalized text.  Words and ngrams spanning segments are counted once, leading spaces are
+   dropped and trailing spaces are held back until more text follows them.  Trigrams are always counted,
+   ngrams of the other sizes of ngram_sizes as well.
+   See normalize_corpus_piece for how to produce segments from pieces of a corpus file.
+
+   Letters are added to letter_counts in order of first appearance, so that the letter frequency list,
+   including the order of letters with equal counts, is the same as that of the whole text.
+   """
+   def __init__(self, ngram_sizes=(3,)):
+      self.word_counts = Counter()
+      self.ngram_counts = dict((n, Counter()) for n in set(ngram_sizes) | set([3]))
+      self.trigram_counts = self.ngram_counts[3]
+      self.letter_counts = Counter()
+      self.letter_order = []
+      # first and last characters of the text, as many as an ngram spanning two segments needs
+      self.context_length = max(self.ngram_counts) - 1
+      self.head = u''
+      self.tail = u''
+      self.partial_word = u''
+      self.pending_spaces = u''
+
+   def add_segment(self, segment):
+      """ Adds the next segment of normalized text, not stripped
+      """
+      if not self.tail: segment = segment.lstrip(' ')
+      body = segment.rstrip(' ')
+      if not body:
+         self.pending_spaces += segment
+         return
+      text = self.pending_spaces + body
+      self.pending_spaces = segment[len(body):]
+      window = self.tail + text
+      for n, ngram_counts in self.ngram_counts.iteritems():
+         # the ngrams that lie in the tail were counted with the segments before
+         ngram_counts.update(window[i:i+n] for i in xrange(max(0, len(self.tail) - n + 1), len(window) - n + 1))
+      if len(self.head) < self.context_length: self.head = (self.head + text)[:self.context_length]
+      self.tail = window[-self.context_length:]
+      self.count_letters(text)
+      words = (self.partial_word + text).split(' ')
+      self.partial_word = words.pop()
+      self.word_counts.update(word for word in words if word)
+
+   def count_letters(self, text):
+      letters = set(text)
+      for letter in sorted(letters.difference(self.letter_counts), key=text.index):
+         self.add_letter(letter)
+      for letter in letters:
+         self.letter_counts[letter] += text.count(letter)
+
+   def add_letter(self, letter):
+      self.letter_counts[letter] = 0
+      self.letter_order.append(letter)
+
+   def merge(self, other):
+      """ Adds the counts of the text that follows, counted by another Corpus_Counter
+
+      The text counted by self has to end with spaces and the other text has to start with a letter,
+      as is the case for the pieces of a file produced by iter_corpus_pieces, so no word spans the two
+      """
+      if not other.tail: return
+      if self.tail:
+         if not self.pending_spaces or other.head[0] == ' ':
+            raise ValueError('merged texts have to be separated by spaces')
+         junction = self.tail + self.pending_spaces + other.head
+         for n, ngram_counts in self.ngram_counts.iteritems():
+            ngram_counts.update(junction[i:i+n] for i in xrange(max(0, len(self.tail) - n + 1), len(self.tail + self.pending_spaces))
+                                if i + n <= len(junction))
+         self.count_letters(self.pending_spaces)
+         self.word_counts[self.partial_word] += 1
+         self.tail = (self.tail + self.pending_spaces + other.tail)[-self.context_length:]
+      else:
+         self.head, self.tail = other.head, other.tail
+      for n, ngram_counts in self.ngram_counts.iteritems():
+         ngram_counts.update(other.ngram_counts[n])
+      for letter in other.letter_order:
+         if letter not in self.letter_counts: self.add_letter(letter)
+      self.letter_counts.update(other.letter_counts)
+      self.word_counts.update(other.word_counts)
+      self.partial_word = other.partial_word
+      self.pending_spaces = other.pending_spaces
+
+   def finish(self):
+      """ Counts the word left at the end of the text
+      """
+      if self.partial_word: self.word_counts[self.partial_word] += 1
+      self.partial_word = u''
+      # an empty text splits into one empty word
+      if not self.word_counts: self.word_counts[u''] = 1
+
+class Normalize_Table(dict):
+   """ Translation table of characters to their class in normalized text, filled in as characters are met.
+   The classes are those of the regular expressions normalize_text used to apply one after another:
+      letters that are ascii once capitalized are capitalized
+      ascii whitespace is a separator, and other punctuation is a separator that is not whitespace;
+      runs of separators become a single space
+      other unicode whitespace and the characters of DROPPED_CHARACTERS are dropped, after separator
+      runs are joined, so they can leave two spaces in a row
+      if remove_nonwords is set, the characters of NONWORD_CHARACTERS mark the tokens between
+      whitespace that remove_nonwords removes
+   """
+   def __init__(self, remove_nonwords=False):
+      self.remove_nonwords = remove_nonwords
+      self.ascii_table = ''.join(self[code].encode('ascii') for code in range(128)) + ''.join(chr(code) for code in range(128, 256))
+
+   def __missing__(self, code):
+      character = unichr(code)
+      if self.remove_nonwords and character in NONWORD_CHARACTERS: normalized = NORMALIZED_NONWORD
+      elif character.upper() in UPPERCASE_ASCII_SET: normalized = character.upper()
+      elif character in ASCII_WHITESPACE: normalized = NORMALIZED_SEPARATOR
+      elif character.isspace(): normalized = NORMALIZED_DROPPED_SEPARATOR
+      elif character in DROPPED_CHARACTERS: normalized = NORMALIZED_DROPPED
+      else: normalized = NORMALIZED_RUN_SEPARATOR
+      self[code] = normalized
+      return normalized
+
+NORMALIZE_TABLE = Normalize_Table()
+CORPUS_NORMALIZE_TABLE = Normalize_Table(remove_nonwords=True)
+
 # BEGIN Global Functions
 
 def write_file(text, filepath, encoding="utf-8-sig"):
@@ -350,6 +1039,295 @@ def write_json(data, path):
       return False
 
 
+def build_corpus_cache_sections(corpus_obj):
+   """ Returns list of (name, bytes) tuples of the sections of the binary corpus cache of a corpus
+
+   Parameters
+   ----------
+   corpus_obj: object of Corpus class
+   """
+   words = sorted(corpus_obj.corpus_dict)
+   encoded_words = [word.encode('utf-8') for word in words]
+   word_offsets = [0]
+   for encoded_word in encoded_words:
+      word_offsets.append(word_offsets[-1] + len(encoded_word))
+   hash_table_size = 1
+   while hash_table_size < 2 * len(words): hash_table_size *= 2
+   hash_table = [0] * hash_table_size
+   for i, encoded_word in enumerate(encoded_words):
+      slot = zlib.crc32(encoded_word) & (hash_table_size - 1)
+      while hash_table[slot]: slot = (slot + 1) & (hash_table_size - 1)
+      hash_table[slot] = i + 1
+   trigram_counts = [0] * len(NGRAM_ALPHABET) ** 3
+   for fragment, count in corpus_obj.trigrams.iteritems():
+      i = ngram_index(fragment) if len(fragment) == 3 else None
+      if i is not None: trigram_counts[i] = count
+   word_numbers = dict((word, i) for i, word in enumerate(words))
+   word_index_sections = []
+   for name, word_index in [('pattern', corpus_obj.build_word_patterns()), ('length', corpus_obj.build_words_by_length())]:
+      key_table = {}
+      key_words = []
+      for key, key_word_list in word_index.iteritems():
+         key_table[unicode(key)] = (len(key_words), len(key_words) + len(key_word_list))
+         key_words.extend(word_numbers[word] for word in key_word_list)
+      word_index_sections += [(name + '_table', json.dumps(key_table)), (name + '_words', struct.pack('<%dI' % len(key_words), *key_words))]
+   ngram_sections = []
+   for n in sorted(set([3, corpus_obj.ngram_size])):
+      table = array.array('d', corpus_obj.build_ngram_log_probabilities(n).table)
+      if sys.byteorder == 'big': table.byteswap()
+      ngram_sections.append(('ngrams%d' % n, table.tostring()))
+   meta = {'total_count': corpus_obj.total_count, 'number_of_words': len(words), 'hash_table_size': hash_table_size}
+   return [('meta', json.dumps(meta)),
+           ('letters', ''.join(corpus_obj.letters_by_frequency).encode('ascii')),
+           ('fingerprint', json.dumps(corpus_obj.build_fingerprint()._asdict())),
+           ('trigrams', struct.pack('<%dQ' % len(trigram_counts), *trigram_counts)),
+           ('word_offsets', struct.pack('<%dI' % len(word_offsets), *word_offsets)),
+           ('words', ''.join(encoded_words)),
+           ('word_counts', struct.pack('<%dI' % len(words), *[corpus_obj.corpus_dict[word] for word in words])),
+           ('word_hash_table', struct.pack('<%dI' % hash_table_size, *hash_table))] + word_index_sections + ngram_sections
+
+def write_corpus_cache(corpus_obj, path):
+   """ writes the binary corpus cache of the word counts, trigram counts and letter frequency list of a corpus
+   returns True if no error encountered when writing;
+   False otherwise
+
+   Parameters
+   ----------
+   corpus_obj: object of Corpus class
+
+   path : string
+   path of cache file to write
+   """
+   temporary_path = None
+   try:
+      sections = build_corpus_cache_sections(corpus_obj)
+      offset = CORPUS_CACHE_HEADER.size + len(sections) * CORPUS_CACHE_SECTION.size
+      section_table = []
+      for name, data in sections:
+         # sections start on 8 byte boundaries so they can be viewed as numpy arrays
+         offset += -offset % 8
+         section_table.append(CORPUS_CACHE_SECTION.pack(name, offset, len(data)))
+         offset += len(data)
+      # the cache is written under a temporary name and renamed so no process reads a partly written cache
+      temporary_path = '%s.%d.tmp' % (path, os.getpid())
+      with open(temporary_path, 'wb') as cache_file:
+         cache_file.write(CORPUS_CACHE_HEADER.pack(CORPUS_CACHE_MAGIC, CORPUS_CACHE_VERSION, len(sections)))
+         cache_file.write(''.join(section_table))
+         for name, data in sections:
+            cache_file.write('\0' * (-cache_file.tell() % 8))
+            cache_file.write(data)
+      os.rename(temporary_path, path)
+      print 'corpus cache written to', path
+      return True
+   except:
+      print 'Failure writing corpus cache to', path
+      traceback.print_exc()
+      if temporary_path and os.path.exists(temporary_path): os.remove(temporary_path)
+      return False
+
+def corpus_file_digest(filepath):
+   """ Returns the sha1 hex digest of the contents of a corpus file
+   """
+   digest = hashlib.sha1()
+   with open(filepath, 'rb') as corpus_file:
+      for data in iter(lambda: corpus_file.read(CORPUS_CHUNK_SIZE), ''):
+         digest.update(data)
+   return digest.hexdigest()
+
+def corpus_cache_key(filepath, ngram_size=3, file_digest=None):
+   """ Returns the sha1 hex digest of the contents of a corpus file and of the settings its cache depends on,
+   the cache version and the ngram size
+
+   Parameters
+   ----------
+   filepath: string
+
+   ngram_size: integer, optional
+
+   file_digest: string, optional
+   The corpus_file_digest of the file, computed if it is not given
+   """
+   key = hashlib.sha1(file_digest or corpus_file_digest(filepath))
+   key.update(json.dumps({'version': CORPUS_CACHE_VERSION, 'ngram_size': ngram_size}, sort_keys=True))
+   return key.hexdigest()
+
+def read_corpus_cache(path):
+   """ Returns Corpus_Cache object of the memory-mapped binary corpus cache
+   returns None if error
+
+   Parameters
+   ----------
+   path : string
+   path of cache file to read
+   """
+   try:
+      return Corpus_Cache(path)
+   except:
+      print "error reading in corpus cache %s" % path
+      return None
+
+def iter_corpus_pieces(filepath, chunk_size, start=0, end=None):
+   """ Yields consecutive pieces of a utf-8 text file, read in chunks of about chunk_size bytes
+
+   Each piece but the last is cut just before a word of ascii letters that has ascii whitespace on both sides,
+   so no token, whitespace run or word spans two pieces and normalize_corpus_piece gives the same result
+   piece by piece as it does on the whole text.  A piece grows past chunk_size until such a word is found.
+
+   Parameters
+   ----------
+   filepath: string
+
+   chunk_size: integer, number of bytes read at a time
+
+   start, end: integers, optional
+   Byte range of the file to read, see find_shard_boundaries
+   """
+   decoder = codecs.getincrementaldecoder('utf-8-sig' if start == 0 else 'utf-8')()
+   with open(filepath, 'rb') as text_file:
+      text_file.seek(start)
+      position = start
+      buffer = u''
+      while end is None or position < end:
+         data = text_file.read(chunk_size if end is None else min(chunk_size, end - position))
+         if not data: break
+         position += len(data)
+         buffer += decoder.decode(data)
+         cut = find_clean_cut(buffer, max(0, len(buffer) - chunk_size))
+         if cut:
+            yield buffer[:cut]
+            buffer = buffer[cut:]
+      buffer += decoder.decode('', True)
+      if buffer: yield buffer
+
+def find_shard_boundaries(filepath, number_of_shards):
+   """ Returns list of byte offsets splitting a utf-8 text file into about number_of_shards ranges,
+   starting with 0 and ending with the file size.  Every offset but the first and last is a clean cut
+   (see iter_corpus_pieces), so the ranges can be normalized and counted separately and merged
+
+   Parameters
+   ----------
+   filepath: string
+
+   number_of_shards: integer
+   """
+   file_size = os.path.getsize(filepath)
+   boundaries = [0]
+   with open(filepath, 'rb') as text_file:
+      for shard in range(1, number_of_shards):
+         position = max(boundaries[-1], file_size * shard // number_of_shards)
+         window_size = 1 << 16
+         while position < file_size:
+            text_file.seek(position)
+            window = text_file.read(window_size)
+            match = CLEAN_CUT_BYTES_PATTERN.search(window)
+            # the word after the cut has to end inside the window
+            if match and match.end() < len(window):
+               if position + match.end() > boundaries[-1]: boundaries.append(position + match.end())
+               break
+            if len(window) < window_size: break
+            window_size *= 2
+   if boundaries[-1] < file_size: boundaries.append(file_size)
+   return boundaries
+
+def count_corpus_shard(shard):
+   """ Returns Corpus_Counter of the words, ngrams and letters of a byte range of a corpus file,
+   used by the worker processes of Corpus.read_corpus
+
+   Parameters
+   ----------
+   shard: tuple of file path, chunk size, start and end byte offsets and the ngram sizes counted
+   """
+   filepath, chunk_size, start, end, ngram_sizes = shard
+   corpus_counter = Corpus_Counter(ngram_sizes)
+   for piece in iter_corpus_pieces(filepath, chunk_size, start, end):
+      corpus_counter.add_segment(normalize_corpus_piece(piece))
+   return corpus_counter
+
+def find_clean_cut(text, start=0):
+   """ Returns the position of the last clean cut (see iter_corpus_pieces) in the text at or after start,
+   None if there is none
+
+   Parameters
+   ----------
+   text: string
+
+   start: integer, optional
+   """
+   cut = None
+   for match in CLEAN_CUT_PATTERN.finditer(text, start):
+      cut = match.end()
+   return cut
+
+def normalize_corpus_piece(piece):
+   """ Returns normalized piece of the corpus text, without the stripping done at the ends of the whole text
+   Pieces produced by iter_corpus_pieces can be counted one after another with a Corpus_Counter
+
+   The piece is normalized as by normalize_text after remove_nonwords, in one pass of CORPUS_NORMALIZE_TABLE
+
+   Parameters
+   ----------
+   piece: string
+   """
+   return translate_normalized(piece, CORPUS_NORMALIZE_TABLE)
+
+def build_letters_by_frequency(frequency_counter):
+   """ Returns a list of the uppercase letters in order of frequency, letters that were not counted come last
+
+   Parameters
+   ----------
+   frequency_counter: Counter object of character counts
+   """
+   letters_by_frequency = OrderedDict(frequency_counter.most_common()).keys()
+   # this filters out punctuation, white spaces and numbers
+   letters_by_frequency = filter(lambda x: x in UPPERCASE_ASCII, letters_by_frequency)
+   missing_letters = list(build_missing_letters(''.join(letters_by_frequency)))
+   return letters_by_frequency + missing_letters
+
+def build_fingerprint(word_counts):
+   """ Returns Fingerprint of a text from the counts of its words:
+          letter_profile: the relative frequencies of the 26 letters, in decreasing order
+          word_length_profile: the relative frequencies of the word lengths from 1 to MAX_FINGERPRINT_WORD_LENGTH,
+          longer words being counted with the longest
+   Neither changes when the text is encrypted by a simple substitution cypher
+
+   Parameters
+   ----------
+   word_counts: dictionary or dict-like of the count of each word of the normalized text
+   """
+   letter_counts = Counter()
+   length_counts = [0] * MAX_FINGERPRINT_WORD_LENGTH
+   for word, count in word_counts.iteritems():
+      if not word: continue
+      length_counts[min(len(word), MAX_FINGERPRINT_WORD_LENGTH) - 1] += count
+      for letter in set(word):
+         letter_counts[letter] += word.count(letter) * count
+   letter_profile = sorted((letter_counts[letter] for letter in UPPERCASE_ASCII), reverse=True)
+   number_of_letters = max(sum(letter_profile), 1)
+   number_of_words = max(sum(length_counts), 1)
+   return Fingerprint([float(count) / number_of_letters for count in letter_profile],
+                      [float(count) / number_of_words for count in length_counts])
+
+def fingerprint_distance(fingerprint1, fingerprint2):
+   """ Returns the distance between two Fingerprints, the sum of the absolute differences of their letter
+   frequencies and of their word length frequencies, from 0 for the same profiles to 4
+   """
+   return (sum(abs(a - b) for a, b in zip(fingerprint1.letter_profile, fingerprint2.letter_profile)) +
+           sum(abs(a - b) for a, b in zip(fingerprint1.word_length_profile, fingerprint2.word_length_profile)))
+
+def rank_corpora(encrypted_text_obj, corpora):
+   """ Returns list of (fingerprint distance, name) tuples of the corpora, the corpus whose fingerprint is
+   closest to that of the encrypted text first.  Ranking only compares fingerprints, so it is cheap next to
+   a search and tells which corpora are worth searching against
+
+   Parameters
+   ----------
+   encrypted_text_obj: object of Encrypted_Text Class
+
+   corpora: dictionary of Corpus objects by name
+   """
+   fingerprint = build_fingerprint(Counter(encrypted_text_obj.list_of_strings))
+   return sorted((fingerprint_distance(fingerprint, corpus_obj.build_fingerprint()), name) for name, corpus_obj in corpora.iteritems())
+
 def make_dir(directory_path):
    """
    Returns True if directory is created
@@ -367,9 +1345,7 @@ def make_dir(directory_path):
    return False
 
 def write_decryption_cipher(decrypt_map, filepath):
-   buffer_lines = []
-   for letter in LOWERCASE_ASCII:
-      buffer_lines.append("%s -> %s" % (letter, letter.translate(decrypt_map) ))
+   buffer_lines = ["%s -> %s" % pair for pair in zip(LOWERCASE_ASCII, LOWERCASE_ASCII.translate(decrypt_map))]
    buffer = '\r\n'.join(buffer_lines)
    try:
       with open(filepath,'w') as file:
@@ -434,7 +1410,7 @@ def normalize_text(text):
       2) removes numbers and punctuation which we aren't using for word splitting
       3) replaces punctuation and whitespace with a single space
 
-      apostrophes are left in
+      apostrophes, hyphens, carets and non-ascii whitespace are dropped, see Normalize_Table
 
    Parameters
    ----------
@@ -442,12 +1418,40 @@ def normalize_text(text):
    text to be normalized
 
    """
-   text =  text.upper()
-   text = re.sub(u"[^a-z,^A-Z,\s\.\,\-^'^’]", ' ', text, flags=re.UNICODE)
-   text = re.sub(u"[\s,\.\|_]+",' ', text)
-   text = re.sub(ur'([^\s\w])+', '',text)
-   text = text.strip()
-   return text
+   return normalize_unstripped_text(text).strip()
+
+def normalize_unstripped_text(text):
+   """ Returns text normalized as by normalize_text but without stripping whitespace from its ends
+
+   Parameters
+   ----------
+   text: string
+   text to be normalized
+
+   """
+   return translate_normalized(text, NORMALIZE_TABLE)
+
+def translate_normalized(text, normalize_table):
+   """ Returns text normalized by a Normalize_Table: the characters are translated to their classes,
+   with non-ascii runs looked up in the table and the ascii text translated as bytes, tokens holding
+   non-words are removed, runs of separators become a single space and dropped characters are removed
+
+   Parameters
+   ----------
+   text: string
+
+   normalize_table: Normalize_Table
+   NORMALIZE_TABLE, or CORPUS_NORMALIZE_TABLE to also remove non-words
+   """
+   try:
+      ascii_text = text.encode('ascii')
+   except UnicodeEncodeError:
+      ascii_text = NON_ASCII_PATTERN.sub(lambda match: match.group().translate(normalize_table), text).encode('ascii')
+   ascii_text = ascii_text.translate(normalize_table.ascii_table)
+   if normalize_table.remove_nonwords and '.' in ascii_text:
+      ascii_text = NONWORD_TOKEN_PATTERN.sub('', ascii_text)
+   ascii_text = SEPARATOR_RUN_PATTERN.sub(' ', ascii_text)
+   return ascii_text.translate(None, str(NORMALIZED_DROPPED_SEPARATOR + NORMALIZED_DROPPED)).decode('ascii')
 
 def filter_by_size(word_counts, word_length, top_n=None):
    """Returns counter object of freqeuncy counts of words, filtered by words of specified word_length
@@ -467,10 +1471,102 @@ def filter_by_size(word_counts, word_length, top_n=None):
    """
    return_counter = Counter({word: count for word, count in word_counts.iteritems() if (len(word) == word_length)})
    if top_n:
-      most_common = [word_tuple[0] for word_tuple in return_counter.most_common(top_n)]
-      return_counter = Counter({word: count for word, count in word_counts.iteritems() if (word in most_common)})
+      return_counter = Counter(dict(return_counter.most_common(top_n)))
    return return_counter
 
+def word_pattern(word):
+   """ Returns the letter repetition pattern of a word: each letter is replaced by the letter of the alphabet
+   numbering its first appearance, so u'THAT' and u'HIGH' both give u'ABCA'
+
+   A simple substitution cypher keeps the pattern of every word
+
+   Parameters
+   ----------
+   word: string
+   """
+   letters = {}
+   return u''.join([letters.setdefault(letter, UPPERCASE_ASCII[len(letters) % len(UPPERCASE_ASCII)]) for letter in word])
+
+def build_word_index(word_counts, key_function):
+   """ Returns Word_Index of the words of each key, most frequent words first and alphabetically on ties
+
+   Parameters
+   ----------
+   word_counts: Counter object
+   Counter(dict) of words and their frequencies
+
+   key_function: function
+   Returns the key of a word, such as len or word_pattern
+   """
+   word_index = {}
+   for word, count in word_counts.iteritems():
+      if word: word_index.setdefault(key_function(word), []).append((-count, word))
+   return Word_Index((key, [word for count, word in sorted(words)]) for key, words in word_index.iteritems())
+
+def fits_partial_key(cypher_word, word, partial_key, used_letters):
+   """ Returns True if the cypher word can decrypt to the word under the partial key, which maps
+   cypher letters to letters, without decrypting two cypher letters to the same letter.
+   Both words must have the same letter pattern
+   """
+   for cypher_letter, letter in zip(cypher_word, word):
+      if cypher_letter in partial_key:
+         if partial_key[cypher_letter] != letter: return False
+      elif letter in used_letters:
+         return False
+   return True
+
+def build_pattern_key(corpus_obj, encrypted_text_obj, max_candidates=MAX_PATTERN_CANDIDATES):
+   """ Returns list of letters, the corpus alphabet list of a key matching encrypted_text_obj.letters_by_frequency,
+   built from the corpus words that share the letter patterns of the cypher words
+
+   Each cypher word of at least MIN_PATTERN_WORD_LENGTH letters is given the max_candidates most frequent
+   corpus words of its pattern.  The cypher word with the fewest candidates that fit the partial key, the
+   longest of those on ties, is decrypted as its most frequent fitting candidate, and the candidates of the
+   other words are narrowed to those that fit the larger key, until no cypher word has a fitting candidate.
+   Letters the partial key leaves out keep their places in corpus_obj.letters_by_frequency where possible
+
+   Parameters
+   ----------
+   corpus_obj: object of Corpus class
+
+   encrypted_text_obj: object of Encrypted_Text Class
+
+   max_candidates: integer, optional
+   """
+   word_patterns = corpus_obj.build_word_patterns()
+   candidates = {}
+   for cypher_word in set(encrypted_text_obj.list_of_strings):
+      if len(cypher_word) >= MIN_PATTERN_WORD_LENGTH:
+         words = word_patterns.get(word_pattern(cypher_word), [], max_candidates)
+         if words: candidates[cypher_word] = words
+   partial_key = {}
+   used_letters = set()
+   while candidates:
+      for cypher_word in candidates.keys():
+         candidates[cypher_word] = [word for word in candidates[cypher_word] if fits_partial_key(cypher_word, word, partial_key, used_letters)]
+         if not candidates[cypher_word]: del candidates[cypher_word]
+      if not candidates: break
+      cypher_word = min(sorted(candidates), key=lambda cypher_word: (len(candidates[cypher_word]), -len(cypher_word)))
+      for cypher_letter, letter in zip(cypher_word, candidates.pop(cypher_word)[0]):
+         partial_key[cypher_letter] = letter
+         used_letters.add(letter)
+   cypher_key_alphabet_list = encrypted_text_obj.letters_by_frequency
+   corpus_alphabet_list = corpus_obj.letters_by_frequency[ : ]
+   for cypher_letter, letter in partial_key.iteritems():
+      if cypher_letter in cypher_key_alphabet_list and letter in corpus_alphabet_list:
+         index1, index2 = cypher_key_alphabet_list.index(cypher_letter), corpus_alphabet_list.index(letter)
+         corpus_alphabet_list[index1], corpus_alphabet_list[index2] = corpus_alphabet_list[index2], corpus_alphabet_list[index1]
+   return corpus_alphabet_list
+
+def build_key(corpus_alphabet_list):
+   """ Returns bytearray of the letters of a corpus alphabet list, the compact key held by a Scorer
+
+   Parameters
+   ----------
+   corpus_alphabet_list: list of single-character uppercase strings
+   """
+   return bytearray(u''.join(corpus_alphabet_list).encode('ascii'))
+
 def build_decrypt_map(input_list, output_list):
    """ returns translation table that is a mapping of 2 lists of letters, 
    Mapping is done in order of the letters in each list.  Assumes both lists are of uppercase letters.
@@ -517,21 +1613,599 @@ def shuffle_keys(key_list, base_list, candidates= None, base_candidates=None):
 
    """
    key_list_tmp = key_list [ : ]
-   if base_list:
-      candidates = build_list_unique_letters(candidates)
-      [item1] = random.sample(candidates,1)
-      index1 = base_list.index(item1)
-      if base_candidates: 
-         base_candidates = build_list_unique_letters(base_candidates)
-         [item2] = random.sample(base_candidates,1)
-         index2 = base_list.index(item2)
-      else:
-         [index2] = random.sample(range(len(base_list)), 1)
-   else:
-      raise ValueError('If a candidates list is passed in, then a base_list is also required')
+   index1, index2 = choose_swap(base_list, candidates, base_candidates)
    key_list_tmp[index1], key_list_tmp[index2] = key_list_tmp[index2], key_list_tmp[index1]
    return key_list_tmp
 
+def choose_swap(base_list, candidates= None, base_candidates=None):
+   """returns a tuple of the 2 positions in the key list that shuffle_keys would swap
+
+   See shuffle_keys for how the candidates and base_candidates lists are used
+
+   Parameters
+   ----------
+   base_list: list of single-character strings, in order for decrypted part of decryption table
+   candidates: list of single-character strings, the letters which are up for swapping
+   base_candidates: list of single-character strings
+
+   """
+   return Swap_Sampler(base_list, candidates, base_candidates).sample()
+
+class Swap_Sampler(object):
+   """ Swap_Sampler draws the positions swapped by choose_swap in O(1)
+
+   The unique letters of the candidates and base_candidates lists and their positions in base_list
+   are found once, so a decryption test builds one sampler and draws all its swaps from it.
+   The draws use the random module exactly as choose_swap always has, so seeded searches are unchanged
+   """
+   def __init__(self, base_list, candidates= None, base_candidates=None):
+      if not base_list:
+         raise ValueError('If a candidates list is passed in, then a base_list is also required')
+      positions = dict((letter, i) for i, letter in reversed(list(enumerate(base_list))))
+      self.indexes1 = [positions[letter] for letter in build_list_unique_letters(candidates)]
+      if base_candidates:
+         self.indexes2 = [positions[letter] for letter in build_list_unique_letters(base_candidates)]
+      else:
+         self.indexes2 = range(len(base_list))
+
+   def sample(self):
+      """ Returns a tuple of 2 positions in base_list to swap
+      """
+      return random.choice(self.indexes1), random.choice(self.indexes2)
+
+def encode_text(text):
+   """Returns numpy array of uint8 codes of the letters in the text: A-Z are coded 0-25 and any other character 26
+
+   Parameters
+   ----------
+   text: string, normalized text
+   """
+   return numpy.array([NGRAM_ALPHABET_INDEX.get(letter, 26) for letter in text], dtype=numpy.uint8)
+
+def ngram_index(fragment):
+   """Returns the position of an ngram in a dense table of ngram counts, reading the ngram as a base-27 number
+   with the letters encoded as in encode_text, most significant first.  Returns None if the ngram has characters
+   that are neither uppercase letters nor spaces
+
+   Parameters
+   ----------
+   fragment: string
+   """
+   i = 0
+   for letter in fragment:
+      letter_index = NGRAM_ALPHABET_INDEX.get(letter)
+      if letter_index is None: return None
+      i = i * len(NGRAM_ALPHABET) + letter_index
+   return i
+
+def build_ngram_table(ngram_counts, n):
+   """ Returns array of 27**n doubles, the base-10 log probability of each ngram of size n indexed by
+   ngram_index.  Probabilities are estimated from the corpus counts with NGRAM_SMOOTHING_COUNT added
+   to the count of every ngram, so they sum to 1 and ngrams missing from the corpus are not impossible
+
+   Parameters
+   ----------
+   ngram_counts: Counter or dict-like of the corpus ngram counts
+
+   n: integer
+   """
+   number_of_ngrams = len(NGRAM_ALPHABET) ** n
+   total = sum(count for fragment, count in ngram_counts.iteritems()) + NGRAM_SMOOTHING_COUNT * number_of_ngrams
+   table = array.array('d', [math.log10(NGRAM_SMOOTHING_COUNT / total)]) * number_of_ngrams
+   for fragment, count in ngram_counts.iteritems():
+      i = ngram_index(fragment) if len(fragment) == n else None
+      if i is not None: table[i] = math.log10((count + NGRAM_SMOOTHING_COUNT) / total)
+   return table
+
+def word_code(word):
+   """Returns integer code of a word of uppercase letters, read as a base-27 number with digits A=1 to Z=26
+   least significant first.  Words of up to MAX_WORD_CODE_LENGTH letters fit in an int64
+
+   Parameters
+   ----------
+   word: string
+   """
+   code = 0
+   for letter in reversed(word):
+      code = code * len(NGRAM_ALPHABET) + NGRAM_ALPHABET_INDEX[letter] + 1
+   return code
+
+def index_by_letter(text_list):
+   """Returns dictionary mapping each character to the list of indexes of the strings in text_list that contain it
+
+   Parameters
+   ----------
+   text_list: list of strings
+   """
+   letter_index = {}
+   for i, text in enumerate(text_list):
+      for letter in set(text):
+         letter_index.setdefault(letter, []).append(i)
+   return letter_index
+
+class Scorer(object):
+   """ Scorer: base class of the scoring backends used by decrypt()
+
+   A scorer holds the current decryption key and scores two-letter swaps of it.  Every backend returns
+   the same (composite score, ratio of words found) tuples as score_decryption.
+
+   The key is held as two aligned lists as in decrypt(): cypher_key_alphabet_list[i] decrypts to
+   corpus_alphabet_list[i].  Swaps are given as two positions in these lists.  The corpus alphabet list is
+   also held as key, a 26 byte bytearray swapped in place, whose string identifies the key in a Score_Cache.
+   A translation table is only built by build_decrypt_map when text is to be decrypted.
+
+   Subclasses implement score_key; the base class scores a swap by scoring the whole swapped key.
+   Scores of backends that are not cacheable depend on more than the key and are not kept in a Score_Cache.
+   """
+   cacheable = True
+
+   def __init__(self, corpus_obj, encrypted_text_obj, cypher_key_alphabet_list, corpus_alphabet_list):
+      self.corpus_obj = corpus_obj
+      self.encrypted_text_obj = encrypted_text_obj
+      self.cypher_key_alphabet_list = cypher_key_alphabet_list
+      self.pending_swap = None
+      self.reset(corpus_alphabet_list)
+
+   def reset(self, corpus_alphabet_list):
+      """ Sets the key to corpus_alphabet_list and scores it
+      """
+      self.corpus_alphabet_list = corpus_alphabet_list[ : ]
+      self.key = build_key(self.corpus_alphabet_list)
+      self.current_scores = self.score_key(self.corpus_alphabet_list)
+      self.pending_swap = None
+
+   def score_key(self, corpus_alphabet_list):
+      """ Returns the (composite score, ratio of words found) tuple of a whole key
+      """
+      raise NotImplementedError
+
+   def score(self):
+      """ Returns the (composite score, ratio of words found) tuple of the current key
+      """
+      return self.current_scores
+
+   def score_swap(self, index1, index2):
+      """ Returns the (composite score, ratio of words found) tuple of the current key with two positions swapped
+      The current key is left unchanged; apply_swap makes the swap permanent
+
+      Parameters
+      ----------
+      index1, index2: integers, positions in cypher_key_alphabet_list of the two letters to swap
+      """
+      test_corpus_alphabet_list = self.corpus_alphabet_list[ : ]
+      test_corpus_alphabet_list[index1], test_corpus_alphabet_list[index2] = test_corpus_alphabet_list[index2], test_corpus_alphabet_list[index1]
+      scores = self.score_key(test_corpus_alphabet_list)
+      self.pending_swap = ((index1, index2), scores)
+      return scores
+
+   def apply_swap(self, index1, index2):
+      """ Swaps two positions of the current key, reusing the scores of the last score_swap call when it matches
+      """
+      if not self.pending_swap or self.pending_swap[0] != (index1, index2):
+         self.score_swap(index1, index2)
+      self.current_scores = self.pending_swap[1]
+      self.corpus_alphabet_list[index1], self.corpus_alphabet_list[index2] = self.corpus_alphabet_list[index2], self.corpus_alphabet_list[index1]
+      self.key[index1], self.key[index2] = self.key[index2], self.key[index1]
+      self.pending_swap = None
+
+   def swapped_key(self, index1, index2):
+      """ Returns the string of the current key with two positions swapped, the key itself is left unchanged
+      """
+      key = self.key
+      key[index1], key[index2] = key[index2], key[index1]
+      key_string = str(key)
+      key[index1], key[index2] = key[index2], key[index1]
+      return key_string
+
+   def build_decrypt_map(self):
+      """ Returns the translation table of the current key, see build_decrypt_map
+      """
+      return build_decrypt_map(self.cypher_key_alphabet_list, self.corpus_alphabet_list)
+
+   def score_swaps(self, swaps):
+      """ Returns list of the (composite score, ratio of words found) tuples of the current key with each swap applied
+      Backends that can score many keys at once override this
+
+      Parameters
+      ----------
+      swaps: list of (index1, index2) tuples, see score_swap
+      """
+      return [self.score_swap(index1, index2) for index1, index2 in swaps]
+
+class Score_Cache(object):
+   """ Score_Cache is a bounded least recently used cache of the (composite score, ratio of words found)
+   tuples of keys, shared by the restarts of a run so keys that were already scored are not scored again
+
+   Keys are stored as the 26 byte string of the key of a Scorer, the letters of the corpus alphabet list,
+   which identifies the key for a given cypher key alphabet list.  hits and misses count the lookups that did and did not find a score
+   """
+   def __init__(self, max_size=SCORE_CACHE_SIZE):
+      self.max_size = max_size
+      self.scores = OrderedDict()
+      self.hits = 0
+      self.misses = 0
+
+   def get(self, key):
+      """ Returns the scores of the key, None if they are not cached
+      """
+      scores = self.scores.pop(key, None)
+      if scores is None:
+         self.misses += 1
+         return None
+      self.hits += 1
+      self.scores[key] = scores
+      return scores
+
+   def put(self, key, scores):
+      self.scores.pop(key, None)
+      self.scores[key] = scores
+      if len(self.scores) > self.max_size: self.scores.popitem(last=False)
+
+   def __len__(self):
+      return len(self.scores)
+
+   def summary(self):
+      lookups = max(self.hits + self.misses, 1)
+      return "score cache: %d hits, %d misses, %.1f%% hit rate, %d keys" % (self.hits, self.misses, 100.0 * self.hits / lookups, len(self.scores))
+
+def score_swaps_cached(scorer, swaps, score_cache):
+   """ Returns scorer.score_swaps(swaps), scoring only the swapped keys that are not in the score cache
+
+   Parameters
+   ----------
+   scorer: object of a Scorer class
+
+   swaps: list of (index1, index2) tuples, see Scorer.score_swap
+
+   score_cache: Score_Cache object
+   """
+   keys = []
+   swap_scores = []
+   missing = []
+   for n, (index1, index2) in enumerate(swaps):
+      keys.append(scorer.swapped_key(index1, index2))
+      swap_scores.append(score_cache.get(keys[-1]))
+      if swap_scores[-1] is None: missing.append(n)
+   if missing:
+      for n, scores in zip(missing, scorer.score_swaps([swaps[n] for n in missing])):
+         swap_scores[n] = scores
+         score_cache.put(keys[n], scores)
+   return swap_scores
+
+class Full_Text_Scorer(Scorer):
+   """ Full_Text_Scorer scores every candidate key with score_decryption
+   """
+   def score_key(self, corpus_alphabet_list):
+      decrypt_map = build_decrypt_map(self.cypher_key_alphabet_list, corpus_alphabet_list)
+      return score_decryption(self.corpus_obj, self.encrypted_text_obj, decrypt_map)
+
+class Incremental_Scorer(Scorer):
+   """ Incremental_Scorer keeps the scores of each cipher word and trigram and rescores two-letter swaps of the key
+
+   Only the cipher words and trigrams containing the swapped letters are retranslated and looked up
+   in the corpus, so the cost of scoring a swap depends on how often the swapped letters occur rather
+   than on the length of the encrypted text.
+   """
+   def __init__(self, corpus_obj, encrypted_text_obj, cypher_key_alphabet_list, corpus_alphabet_list):
+      self.count_strings(encrypted_text_obj.list_of_strings, divide_ngrams(encrypted_text_obj.normalized_text, 3))
+      Scorer.__init__(self, corpus_obj, encrypted_text_obj, cypher_key_alphabet_list, corpus_alphabet_list)
+
+   def count_strings(self, word_list, trigram_counts):
+      """ Sets the distinct cipher words and trigrams that are scored and their multiplicities
+
+      Parameters
+      ----------
+      word_list: list of the cipher words, repeated as often as they occur
+
+      trigram_counts: Counter of the cipher trigrams
+      """
+      word_counts = Counter(word_list)
+      self.words = word_counts.keys()
+      self.word_multiplicity = [word_counts[word] for word in self.words]
+      self.number_of_words = len(word_list)
+      # a decryption key is a one to one mapping so the number of distinct trigrams never changes
+      self.trigrams = trigram_counts.keys()
+      self.trigram_multiplicity = [trigram_counts[trigram] for trigram in self.trigrams]
+      self.words_by_letter = index_by_letter(self.words)
+      self.trigrams_by_letter = index_by_letter(self.trigrams)
+
+   def reset(self, corpus_alphabet_list):
+      """ Sets the key to corpus_alphabet_list and scores every cipher word and trigram against it
+      """
+      self.corpus_alphabet_list = corpus_alphabet_list[ : ]
+      self.key = build_key(self.corpus_alphabet_list)
+      # only uppercase letters occur in the normalized text so lowercase entries are left out
+      self.translate_table = dict(zip([ord(letter) for letter in self.cypher_key_alphabet_list], self.corpus_alphabet_list))
+      self.word_scores = [self.score_word(i) for i in range(len(self.words))]
+      self.words_found = [self.find_word(i) for i in range(len(self.words))]
+      self.trigram_counts = [self.count_trigram(i) for i in range(len(self.trigrams))]
+      self.word_score_total = sum(self.word_scores)
+      self.words_found_total = sum(self.words_found)
+      self.trigram_total = sum(self.trigram_counts)
+      self.pending_swap = None
+
+   def score_word(self, i):
+      return self.corpus_obj.score_one_word(self.words[i].translate(self.translate_table)) * self.word_multiplicity[i]
+
+   def find_word(self, i):
+      if self.corpus_obj.corpus_dict.has_key(self.words[i].translate(self.translate_table)):
+         return self.word_multiplicity[i]
+      return 0
+
+   def count_trigram(self, i):
+      return self.corpus_obj.trigrams.get(self.trigrams[i].translate(self.translate_table), 0)
+
+   def build_scores(self, word_score_total, words_found_total, trigram_total):
+      """ Returns the (composite score, ratio of words found) tuple that score_decryption would return for these totals
+      """
+      if self.trigrams: 
+         trigrams_boost = self.corpus_obj.trigram_boost(trigram_total, len(self.trigrams))
+      else:
+         trigrams_boost = None
+      if self.number_of_words:
+         ratio_of_words_found = float(words_found_total) / self.number_of_words
+      else:
+         ratio_of_words_found = None
+      return word_score_total * trigrams_boost, ratio_of_words_found
+
+   def score(self):
+      return self.build_scores(self.word_score_total, self.words_found_total, self.trigram_total)
+
+   def affected(self, strings_by_letter, strings, letter1, letter2):
+      """ Returns list of indexes of the strings containing either letter
+      """
+      affected_list = strings_by_letter.get(letter1, [])[ : ]
+      affected_list.extend(i for i in strings_by_letter.get(letter2, []) if letter1 not in strings[i])
+      return affected_list
+
+   def swap_translate_table(self, letter1, letter2):
+      ord1, ord2 = ord(letter1), ord(letter2)
+      self.translate_table[ord1], self.translate_table[ord2] = self.translate_table[ord2], self.translate_table[ord1]
+
+   def score_swap(self, index1, index2):
+      letter1 = self.cypher_key_alphabet_list[index1]
+      letter2 = self.cypher_key_alphabet_list[index2]
+      if letter1 == letter2: return self.score()
+      self.swap_translate_table(letter1, letter2)
+      word_changes = []
+      word_score_total = self.word_score_total
+      words_found_total = self.words_found_total
+      for i in self.affected(self.words_by_letter, self.words, letter1, letter2):
+         word_score, word_found = self.score_word(i), self.find_word(i)
+         word_score_total += word_score - self.word_scores[i]
+         words_found_total += word_found - self.words_found[i]
+         word_changes.append((i, word_score, word_found))
+      trigram_changes = []
+      trigram_total = self.trigram_total
+      for i in self.affected(self.trigrams_by_letter, self.trigrams, letter1, letter2):
+         trigram_count = self.count_trigram(i)
+         trigram_total += trigram_count - self.trigram_counts[i]
+         trigram_changes.append((i, trigram_count))
+      self.swap_translate_table(letter1, letter2)
+      self.pending_swap = ((index1, index2), word_changes, trigram_changes, word_score_total, words_found_total, trigram_total)
+      return self.build_scores(word_score_total, words_found_total, trigram_total)
+
+   def apply_swap(self, index1, index2):
+      letter1 = self.cypher_key_alphabet_list[index1]
+      letter2 = self.cypher_key_alphabet_list[index2]
+      if letter1 == letter2: return
+      if not self.pending_swap or self.pending_swap[0] != (index1, index2):
+         self.score_swap(index1, index2)
+      swap, word_changes, trigram_changes, self.word_score_total, self.words_found_total, self.trigram_total = self.pending_swap
+      for i, word_score, word_found in word_changes:
+         self.word_scores[i] = word_score
+         self.words_found[i] = word_found
+      for i, trigram_count in trigram_changes:
+         self.trigram_counts[i] = trigram_count
+      self.swap_translate_table(letter1, letter2)
+      self.corpus_alphabet_list[index1], self.corpus_alphabet_list[index2] = self.corpus_alphabet_list[index2], self.corpus_alphabet_list[index1]
+      self.key[index1], self.key[index2] = self.key[index2], self.key[index1]
+      self.pending_swap = None
+
+class Sample_Scorer(Incremental_Scorer):
+   """ Sample_Scorer scores keys as Incremental_Scorer does on a random sample of the cipher words and of the
+   trigram windows of the encrypted text, drawn once with the same ratio from both.  Its scores rank keys
+   as those of the whole text would, roughly, at a cost that depends on the sample size
+   """
+   def __init__(self, corpus_obj, encrypted_text_obj, cypher_key_alphabet_list, corpus_alphabet_list, sample_size):
+      words = encrypted_text_obj.list_of_strings
+      text = encrypted_text_obj.normalized_text
+      sample_ratio = min(1.0, float(sample_size) / max(len(words), 1))
+      number_of_windows = max(len(text) - 2, 0)
+      windows = random.sample(xrange(number_of_windows), int(round(sample_ratio * number_of_windows)))
+      self.count_strings(random.sample(words, int(round(sample_ratio * len(words)))), Counter(text[i:i+3] for i in windows))
+      Scorer.__init__(self, corpus_obj, encrypted_text_obj, cypher_key_alphabet_list, corpus_alphabet_list)
+
+class Progressive_Scorer(Scorer):
+   """ Progressive_Scorer scores swaps on a Sample_Scorer and only rescores the whole text, with an
+   Incremental_Scorer, for swaps that improve the sample score.  Its scores are those of the whole text;
+   a swap the sample rejects scores minus infinity, so decrypt only accepts swaps confirmed on the whole text.
+
+   The sample starts with sample_size cipher words and doubles each time fewer than PROGRESSIVE_MIN_ACCEPTANCE
+   of the last PROGRESSIVE_WINDOW swaps scored were applied, as the search nears an optimum and needs finer
+   scores.  Once it would hold the whole text, swaps are scored on the whole text alone.  Long texts are
+   searched at a cost closer to that of short ones.  Rejections depend on the current key, so the scores
+   are not cacheable
+   """
+   cacheable = False
+
+   def __init__(self, corpus_obj, encrypted_text_obj, cypher_key_alphabet_list, corpus_alphabet_list, sample_size=PROGRESSIVE_SAMPLE_SIZE):
+      self.full_scorer = Incremental_Scorer(corpus_obj, encrypted_text_obj, cypher_key_alphabet_list, corpus_alphabet_list)
+      self.sample_size = sample_size
+      Scorer.__init__(self, corpus_obj, encrypted_text_obj, cypher_key_alphabet_list, corpus_alphabet_list)
+
+   def reset(self, corpus_alphabet_list):
+      self.full_scorer.reset(corpus_alphabet_list)
+      # the key is swapped in place by the whole text scorer
+      self.corpus_alphabet_list = self.full_scorer.corpus_alphabet_list
+      self.key = self.full_scorer.key
+      self.pending_swap = None
+      self.build_sample()
+
+   def build_sample(self):
+      """ Draws the sample of sample_size cipher words the swaps are scored on, None once it would be the whole text
+      """
+      if self.sample_size < self.full_scorer.number_of_words:
+         self.sample_scorer = Sample_Scorer(self.corpus_obj, self.encrypted_text_obj, self.cypher_key_alphabet_list,
+                                            self.corpus_alphabet_list, self.sample_size)
+      else:
+         self.sample_scorer = None
+      self.swaps_scored = 0
+      self.swaps_applied = 0
+
+   def score(self):
+      return self.full_scorer.score()
+
+   def score_swap(self, index1, index2):
+      if self.sample_scorer is not None and self.swaps_scored >= PROGRESSIVE_WINDOW:
+         # the sample is only redrawn when it grows, it stays the same fixed subset while swaps are still accepted
+         if self.swaps_applied < PROGRESSIVE_MIN_ACCEPTANCE * self.swaps_scored:
+            self.sample_size *= 2
+            self.build_sample()
+         else:
+            self.swaps_scored = 0
+            self.swaps_applied = 0
+      self.swaps_scored += 1
+      if self.sample_scorer is None: return self.full_scorer.score_swap(index1, index2)
+      sample_scores = self.sample_scorer.score_swap(index1, index2)
+      if sample_scores[0] <= self.sample_scorer.score()[0]: return float('-inf'), sample_scores[1]
+      return self.full_scorer.score_swap(index1, index2)
+
+   def apply_swap(self, index1, index2):
+      self.full_scorer.apply_swap(index1, index2)
+      if self.sample_scorer is not None: self.sample_scorer.apply_swap(index1, index2)
+      self.swaps_applied += 1
+
+class Log_Probability_Scorer(Incremental_Scorer):
+   """ Log_Probability_Scorer scores keys by the base-10 log probability of the decrypted text's ngrams
+   under the smoothed corpus ngram frequencies, rescoring two-letter swaps incrementally
+
+   Returns (log probability, ratio of words found) tuples.  The log probability is the sum over every
+   ngram position of the text of the precomputed log probabilities of Corpus.build_ngram_log_probabilities,
+   the ngrams being of the corpus ngram_size.  The cipher ngrams are kept where Incremental_Scorer keeps
+   its trigrams.  Used by anneal() and as the logprob scoring backend of decrypt()
+   """
+   def __init__(self, corpus_obj, encrypted_text_obj, cypher_key_alphabet_list, corpus_alphabet_list):
+      self.log_probabilities = corpus_obj.build_ngram_log_probabilities()
+      self.count_strings(encrypted_text_obj.list_of_strings, divide_ngrams(encrypted_text_obj.normalized_text, self.log_probabilities.n))
+      Scorer.__init__(self, corpus_obj, encrypted_text_obj, cypher_key_alphabet_list, corpus_alphabet_list)
+
+   def score_word(self, i):
+      return 0.0
+
+   def count_trigram(self, i):
+      return self.log_probabilities[self.trigrams[i].translate(self.translate_table)] * self.trigram_multiplicity[i]
+
+   def build_scores(self, word_score_total, words_found_total, trigram_total):
+      return trigram_total, float(words_found_total) / max(self.number_of_words, 1)
+
+class Numpy_Scorer(Scorer):
+   """ Numpy_Scorer scores candidate keys with vectorized lookups in dense numpy tables
+
+   The encrypted text is encoded once as integer arrays (see encode_text) and the corpus trigram counts
+   are held in a dense 27x27x27 array, so scoring a key is a gather of the decrypted trigram counts
+   and a sorted search of the decrypted word codes.  Requires numpy.
+   """
+   def __init__(self, corpus_obj, encrypted_text_obj, cypher_key_alphabet_list, corpus_alphabet_list):
+      if numpy is None:
+         raise ImportError('the numpy scoring backend requires numpy')
+      self.trigram_array = corpus_obj.build_trigram_array().ravel()
+      self.word_codes, self.word_code_scores = corpus_obj.build_word_code_arrays()
+      word_counts = Counter(encrypted_text_obj.list_of_strings)
+      coded_words = [word for word in word_counts if len(word) <= MAX_WORD_CODE_LENGTH]
+      # longer words are too long to encode and are looked up in the corpus one at a time
+      self.long_words = [(word, word_counts[word]) for word in word_counts if len(word) > MAX_WORD_CODE_LENGTH]
+      # letter 27 pads the words out to MAX_WORD_CODE_LENGTH and decrypts to the 0 digit
+      self.word_letters = numpy.array([list(encode_text(word)) + [27] * (MAX_WORD_CODE_LENGTH - len(word)) for word in coded_words],
+                                      dtype=numpy.intp).reshape(len(coded_words), MAX_WORD_CODE_LENGTH)
+      self.word_multiplicity = numpy.array([word_counts[word] for word in coded_words], dtype=numpy.int64)
+      self.word_code_powers = len(NGRAM_ALPHABET) ** numpy.arange(MAX_WORD_CODE_LENGTH, dtype=numpy.int64)
+      self.number_of_words = len(encrypted_text_obj.list_of_strings)
+      trigrams = divide_ngrams(encrypted_text_obj.normalized_text, 3).keys()
+      self.trigram_letters = numpy.array([list(encode_text(trigram)) for trigram in trigrams], dtype=numpy.intp).reshape(len(trigrams), 3)
+      Scorer.__init__(self, corpus_obj, encrypted_text_obj, cypher_key_alphabet_list, corpus_alphabet_list)
+
+   def build_key_array(self, corpus_alphabet_list):
+      """ Returns array of 26 codes, item c being the encoded decryption of the cipher letter encoded as c
+      """
+      key_array = numpy.arange(len(UPPERCASE_ASCII), dtype=numpy.intp)
+      for cypher_letter, corpus_letter in zip(self.cypher_key_alphabet_list, corpus_alphabet_list):
+         key_array[NGRAM_ALPHABET_INDEX[cypher_letter]] = NGRAM_ALPHABET_INDEX[corpus_letter]
+      return key_array
+
+   def score_key(self, corpus_alphabet_list):
+      composite_scores, ratios_of_words_found = self.score_keys(self.build_key_array(corpus_alphabet_list)[numpy.newaxis])
+      return float(composite_scores[0]), float(ratios_of_words_found[0])
+
+   def score_swaps(self, swaps):
+      key_arrays = numpy.tile(self.build_key_array(self.corpus_alphabet_list), (len(swaps), 1))
+      rows = numpy.arange(len(swaps))
+      columns1 = numpy.array([NGRAM_ALPHABET_INDEX[self.cypher_key_alphabet_list[index1]] for index1, index2 in swaps], dtype=numpy.intp)
+      columns2 = numpy.array([NGRAM_ALPHABET_INDEX[self.cypher_key_alphabet_list[index2]] for index1, index2 in swaps], dtype=numpy.intp)
+      key_arrays[rows, columns1], key_arrays[rows, columns2] = key_arrays[rows, columns2], key_arrays[rows, columns1]
+      composite_scores, ratios_of_words_found = self.score_keys(key_arrays)
+      return zip(composite_scores.tolist(), ratios_of_words_found.tolist())
+
+   def score_keys(self, key_arrays):
+      """ Returns a tuple of 2 numpy arrays: the composite scores and the ratios of words found of each key
+
+      Parameters
+      ----------
+      key_arrays: (N x 26) integer array, row n is a key as returned by build_key_array
+      """
+      # the space and the word padding letter decrypt to themselves
+      key_arrays = numpy.hstack([key_arrays, numpy.tile([len(NGRAM_ALPHABET) - 1, len(NGRAM_ALPHABET)], (len(key_arrays), 1))])
+      composite_scores = numpy.empty(len(key_arrays))
+      ratios_of_words_found = numpy.empty(len(key_arrays))
+      # keys are scored in blocks to bound the size of the (keys x words x letters) arrays
+      block_size = max(1, BATCH_ARRAY_SIZE // max(1, self.word_letters.size + self.trigram_letters.size))
+      for start in range(0, len(key_arrays), block_size):
+         block = key_arrays[start:start + block_size]
+         trigrams = block[:, self.trigram_letters]
+         trigram_totals = self.trigram_array[(trigrams[..., 0] * len(NGRAM_ALPHABET) + trigrams[..., 1]) * len(NGRAM_ALPHABET) + trigrams[..., 2]].sum(axis=1)
+         # decrypted letters are coded 1-26 and the padding 0, see word_code
+         codes = ((block[:, self.word_letters] + 1) % (len(NGRAM_ALPHABET) + 1)).dot(self.word_code_powers)
+         if len(self.word_codes):
+            positions = numpy.minimum(numpy.searchsorted(self.word_codes, codes), len(self.word_codes) - 1)
+            found = self.word_codes[positions] == codes
+            word_score_totals = (numpy.where(found, self.word_code_scores[positions], 0.0) * self.word_multiplicity).sum(axis=1)
+            words_found_totals = (found * self.word_multiplicity).sum(axis=1)
+         else:
+            word_score_totals = numpy.zeros(len(block))
+            words_found_totals = numpy.zeros(len(block), dtype=numpy.int64)
+         for n in range(len(block)):
+            word_score_total, words_found_total = float(word_score_totals[n]), int(words_found_totals[n])
+            if self.long_words:
+               translate_table = dict((ord(letter), NGRAM_ALPHABET[block[n, i]]) for i, letter in enumerate(UPPERCASE_ASCII))
+               for word, multiplicity in self.long_words:
+                  decrypted_word = word.translate(translate_table)
+                  word_score_total += self.corpus_obj.score_one_word(decrypted_word) * multiplicity
+                  if self.corpus_obj.corpus_dict.has_key(decrypted_word): words_found_total += multiplicity
+            trigrams_boost = self.corpus_obj.trigram_boost(int(trigram_totals[n]), len(self.trigram_letters))
+            composite_scores[start + n] = word_score_total * trigrams_boost
+            ratios_of_words_found[start + n] = float(words_found_total) / max(self.number_of_words, 1)
+      return composite_scores, ratios_of_words_found
+
+SCORING_BACKENDS = {'full': Full_Text_Scorer, 'incremental': Incremental_Scorer, 'numpy': Numpy_Scorer, 'progressive': Progressive_Scorer,
+                    'logprob': Log_Probability_Scorer}
+
+def score_decryption_batch(corpus_obj, encrypted_text_obj, keys):
+   """
+   Returns a tuple of 2 numpy arrays: the composite score and the ratio of words found in the corpus
+   of each key, as score_decryption would calculate them.  Requires numpy.
+
+   Parameters
+   ----------
+   corpus_obj: object of Corpus class
+
+   encrypted_text_obj: object of Encrypted_Text Class
+
+   keys: (N x 26) integer array
+   keys[n, c] is the letter, counting A as 0, that the cipher letter c decrypts to in key n
+   """
+   scorer = Numpy_Scorer(corpus_obj, encrypted_text_obj, list(UPPERCASE_ASCII), list(UPPERCASE_ASCII))
+   return scorer.score_keys(numpy.asarray(keys, dtype=numpy.intp).reshape(-1, len(UPPERCASE_ASCII)))
+
 def score_decryption(corpus_obj, encrypted_text_obj, decrypt_map):
    """
    Returns a tuple containing two floating point numerals: 
@@ -570,105 +2244,770 @@ def build_decryption_tests(corpus_obj, encrypted_text_obj,config_list_of_tuples)
 
    encrypted_text_obj: object of Encrypted_Text Class
 
-   config_list_of_tuples: 
+   config_list_of_tuples: list of (word length, top N) tuples
+   The candidate letters of a test are those of the encrypted words of the length and of the top N corpus
+   words of the length, read from the length index of the corpus so the corpus is not scanned
    """
    return_list = []
+   corpus_words_by_length = corpus_obj.build_words_by_length()
+   cipher_words_by_length = build_word_index(Counter(encrypted_text_obj.list_of_strings), len)
    for config_tuple in config_list_of_tuples:
       if config_tuple[0]:
-         corpus_candidate_dict = filter_by_size(corpus_obj.corpus_dict,config_tuple[0], config_tuple[1])
-         corpus_candidate_letters = build_list_unique_letters(corpus_candidate_dict.keys())
-         cipher_candidate_dict = filter_by_size(Counter(encrypted_text_obj.list_of_strings),config_tuple[0])
-         cipher_candidate_letters = build_list_unique_letters(cipher_candidate_dict.keys())
+         corpus_candidate_letters = build_list_unique_letters(corpus_words_by_length.get(config_tuple[0], [], config_tuple[1]))
+         cipher_candidate_letters = build_list_unique_letters(cipher_words_by_length.get(config_tuple[0], []))
          number_of_shuffles = len(corpus_candidate_letters)*len(cipher_candidate_letters)*2
          return_list.append((cipher_candidate_letters,corpus_candidate_letters, number_of_shuffles))
       else:
          return_list.append((cipher_candidate_letters, None, math.pow(len(UPPERCASE_ASCII),2) ))
    return return_list
 
-def decrypt(corpus_obj, encrypted_text_obj):
+def decrypt(corpus_obj, encrypted_text_obj, backend='incremental', block_size=1, initial_key=None, decryption_tests=None,
+            score_cache=None, trace=None, try_number=None, stop_ratio=0.96, max_evaluations=None, plateau_evaluations=None,
+            deadline=None, **options):
    """ Returns a tuple of:
           item 1: a dictionary of our best fitting decryption table 
           item 2: ratio of words in our decrypted text found in the corpus
       
-      A best fit ratio over 0.95 will return out of the function witout further iterations
-      This 0.95 ratio is hardcoded but should be made into a configurable parameter
+      A best fit ratio over stop_ratio will return out of the function witout further iterations
    
    Parameters
    ----------
    corpus_obj: object of Corpus class
 
    encrypted_text_obj: object of Encrypted_Text Class
+
+   backend: string, optional
+   Name of the scoring backend in SCORING_BACKENDS used to score candidate keys
+
+   block_size: integer, optional
+   Number of swaps proposed and scored together; the best of each block is kept if it improves the score.
+   Blocks of more than 1 swap are worthwhile with the numpy backend, which scores a block in one pass
+
+   initial_key: list of single-character strings, optional
+   Corpus alphabet list the search starts from, such as the one of build_pattern_key.  The default is
+   corpus_obj.letters_by_frequency, matching the letters of the encrypted text by frequency
+
+   decryption_tests: list of tuples, optional
+   build_decryption_tests of DECRYPTION_TESTS, which is built when not given.  run_decryption_iterations
+   builds it once for all restarts
+
+   score_cache: Score_Cache object, optional
+   Cache of the scores of keys, looked up before scoring a swap.  run_decryption_iterations shares one
+   across its restarts
+
+   trace: Search_Trace object, optional
+   Records the candidates scored, acceptances, scoring time and best score trajectory of each decryption
+   test phase, see Phase_Trace.  try_number is the restart number recorded with them
+
+   stop_ratio: float, optional
+   The search returns as soon as the key finds more than this ratio of words in the corpus
+
+   max_evaluations, plateau_evaluations: integers, optional
+   The search returns once it has scored max_evaluations candidate keys, or plateau_evaluations candidate
+   keys since its score last improved, see Search_Config
+
+   deadline: float, optional
+   time.time() at which the search returns the best key found so far
+
+   options: options of other search engines, ignored
    """
    cypher_key_alphabet_list = encrypted_text_obj.letters_by_frequency 
-   corpus_alphabet_list = corpus_obj.letters_by_frequency
-   decrypt_map = build_decrypt_map(cypher_key_alphabet_list,corpus_alphabet_list)
+   corpus_alphabet_list = initial_key or corpus_obj.letters_by_frequency
 
-   best_score, ratio_of_words_found = score_decryption(corpus_obj, encrypted_text_obj, decrypt_map)
-   decryption_tests = build_decryption_tests(corpus_obj, encrypted_text_obj, [(1,2),(2,30),(3,30),(4,200),(5,300)])
+   scorer = SCORING_BACKENDS[backend](corpus_obj, encrypted_text_obj, cypher_key_alphabet_list, corpus_alphabet_list)
+   best_score, ratio_of_words_found = scorer.score()
+   decryption_tests = decryption_tests or build_decryption_tests(corpus_obj, encrypted_text_obj, DECRYPTION_TESTS)
    i = 0
-   for decryption_test in decryption_tests:
-      for t in range(decryption_test[2]):
-         test_corpus_alphabet_list = shuffle_keys(corpus_alphabet_list[ : ], cypher_key_alphabet_list, decryption_test[0], decryption_test[1])
-         test_decrypt_map = build_decrypt_map(cypher_key_alphabet_list, test_corpus_alphabet_list)
-         score_test, ratio_of_words_found_test = score_decryption(corpus_obj, encrypted_text_obj, test_decrypt_map)
+   last_improvement = 0
+   for phase, decryption_test in enumerate(decryption_tests):
+      swap_sampler = Swap_Sampler(cypher_key_alphabet_list, decryption_test[0], decryption_test[1])
+      phase_trace = trace.start_phase('hill_climb', try_number, phase, best_score) if trace is not None else None
+      for t in range(0, decryption_test[2], block_size):
+         swaps = [swap_sampler.sample() for s in range(min(block_size, decryption_test[2] - t))]
+         if phase_trace: scoring_start = time.time()
+         swap_scores = score_swaps_cached(scorer, swaps, score_cache) if score_cache is not None and scorer.cacheable else scorer.score_swaps(swaps)
+         if phase_trace: phase_trace.scored(len(swaps), time.time() - scoring_start)
+         best_swap = max(range(len(swaps)), key=lambda n: swap_scores[n][0])
+         score_test, ratio_of_words_found_test = swap_scores[best_swap]
          if score_test > best_score:
-            decrypt_map = test_decrypt_map
+            scorer.apply_swap(*swaps[best_swap])
             best_score = score_test
-            corpus_alphabet_list = test_corpus_alphabet_list
             ratio_of_words_found = ratio_of_words_found_test
-            if ratio_of_words_found > 0.96:
-               return decrypt_map, ratio_of_words_found
-         i += 1
-         if i % 1000 == 0: print "progress: ", encrypted_text_obj.translate(decrypt_map, False)[:50]     
-   return decrypt_map, ratio_of_words_found
-
-def run_decryption_iterations(encrypted_text_obj, corpus_obj, tolerance=0.98):   
-   for i in range(200): 
-      print "try # %d "  % (i+1)
-      if i == 0:
-         decrypt_map, ratio_of_words_found_best = decrypt(corpus_obj, encrypted_text_obj)
-      else:
-         decrypt_map_candidate, ratio_of_words_found_candidate = decrypt(corpus_obj, encrypted_text_obj)
-         if ratio_of_words_found_candidate > ratio_of_words_found_best:
+            if phase_trace: phase_trace.accepted(best_score)
+            if ratio_of_words_found > stop_ratio:
+               if phase_trace: phase_trace.finish(ratio_of_words_found)
+               return scorer.build_decrypt_map(), ratio_of_words_found
+            last_improvement = i + len(swaps)
+         i += len(swaps)
+         if i // 1000 > (i - len(swaps)) // 1000: print "progress: ", encrypted_text_obj.translate(scorer.build_decrypt_map(), False)[:50]     
+         if search_budget_spent(i, last_improvement, max_evaluations, plateau_evaluations, deadline): break
+      if phase_trace: phase_trace.finish(ratio_of_words_found)
+      if search_budget_spent(i, last_improvement, max_evaluations, plateau_evaluations, deadline): break
+   return scorer.build_decrypt_map(), ratio_of_words_found
+
+def anneal(corpus_obj, encrypted_text_obj, schedule=None, stop_ratio=0.96, initial_key=None, trace=None, try_number=None,
+           max_evaluations=None, plateau_evaluations=None, deadline=None, **options):
+   """ Returns a tuple of:
+          item 1: a dictionary of the best fitting decryption table found
+          item 2: ratio of words in our decrypted text found in the corpus
+
+   Simulated annealing search engine, an alternative to decrypt().  Random swaps of two letters of the key
+   are scored by the log probability of the decrypted ngrams (see Log_Probability_Scorer).  Better keys
+   are always accepted and worse keys with probability exp(change / (temperature * number of ngrams)),
+   so the search can leave local optima without restarting.  The temperature falls by the cooling rate
+   after every steps_per_temperature proposals, down to the minimum temperature.
+
+   Parameters
+   ----------
+   corpus_obj: object of Corpus class
+
+   encrypted_text_obj: object of Encrypted_Text Class
+
+   schedule: Annealing_Schedule, optional
+   Defaults to DEFAULT_ANNEALING_SCHEDULE
+
+   stop_ratio: float, optional
+   The search returns as soon as the best key finds more than this ratio of words in the corpus
+
+   initial_key: list of single-character strings, optional
+   Corpus alphabet list the search starts from, see decrypt
+
+   trace, try_number: optional, see decrypt.  Each temperature of the schedule is traced as a phase
+
+   max_evaluations, plateau_evaluations: integers, optional, see decrypt.  The search also returns once it
+   has scored plateau_evaluations keys since its best key was found
+
+   deadline: float, optional, see decrypt
+
+   options: options of other search engines, ignored
+   """
+   schedule = schedule or DEFAULT_ANNEALING_SCHEDULE
+   cypher_key_alphabet_list = encrypted_text_obj.letters_by_frequency
+   scorer = Log_Probability_Scorer(corpus_obj, encrypted_text_obj, cypher_key_alphabet_list, initial_key or corpus_obj.letters_by_frequency)
+   fitness, ratio_of_words_found = scorer.score()
+   best_fitness, best_ratio_of_words_found, best_key = fitness, ratio_of_words_found, str(scorer.key)
+   # temperatures are per ngram so the schedule does not depend on the length of the text
+   number_of_ngrams = max(1, sum(scorer.trigram_multiplicity))
+   temperature = schedule.start_temperature
+   phase = evaluations = last_improvement = 0
+   while (temperature > schedule.min_temperature and best_ratio_of_words_found <= stop_ratio
+          and not search_budget_spent(evaluations, last_improvement, max_evaluations, plateau_evaluations, deadline)):
+      phase_trace = trace.start_phase('anneal', try_number, phase, best_fitness) if trace is not None else None
+      for t in range(schedule.steps_per_temperature):
+         index1, index2 = random.sample(range(len(cypher_key_alphabet_list)), 2)
+         if phase_trace: scoring_start = time.time()
+         fitness_test, ratio_of_words_found_test = scorer.score_swap(index1, index2)
+         if phase_trace: phase_trace.scored(1, time.time() - scoring_start)
+         evaluations += 1
+         change = fitness_test - fitness
+         if change >= 0 or random.random() < math.exp(change / (temperature * number_of_ngrams)):
+            scorer.apply_swap(index1, index2)
+            fitness, ratio_of_words_found = fitness_test, ratio_of_words_found_test
+            if phase_trace: phase_trace.accepted(max(fitness, best_fitness))
+            if fitness > best_fitness:
+               best_fitness, best_ratio_of_words_found, best_key = fitness, ratio_of_words_found, str(scorer.key)
+               last_improvement = evaluations
+               if best_ratio_of_words_found > stop_ratio: break
+         if search_budget_spent(evaluations, last_improvement, max_evaluations, plateau_evaluations, deadline): break
+      if phase_trace: phase_trace.finish(best_ratio_of_words_found, temperature=temperature)
+      temperature *= schedule.cooling_rate
+      phase += 1
+   return build_decrypt_map(cypher_key_alphabet_list, list(best_key.decode('ascii'))), best_ratio_of_words_found
+
+SEARCH_ENGINES = {'hill_climb': decrypt, 'anneal': anneal}
+
+def search_budget_spent(evaluations, last_improvement, max_evaluations, plateau_evaluations, deadline=None):
+   """ Returns True if a restart that has scored evaluations candidate keys, the last that improved its score
+   being number last_improvement, has spent max_evaluations or plateau_evaluations, or has run past the
+   deadline, a time.time() value.  None is no limit
+   """
+   if max_evaluations is not None and evaluations >= max_evaluations: return True
+   if deadline is not None and time.time() >= deadline: return True
+   return plateau_evaluations is not None and evaluations - last_improvement >= plateau_evaluations
+
+def check_search_config(config):
+   """ Returns a message saying what is wrong with a Search_Config, None if nothing is
+
+   Parameters
+   ----------
+   config: Search_Config
+   """
+   is_number = lambda value: isinstance(value, (int, long, float)) and not isinstance(value, bool)
+   is_count = lambda value: isinstance(value, (int, long)) and not isinstance(value, bool) and value >= 0
+   for field in ['tolerance', 'stop_ratio']:
+      if not is_number(getattr(config, field)):
+         return '%s must be a number, not %r' % (field, getattr(config, field))
+   if not is_count(config.max_tries) or config.max_tries < 1:
+      return 'max_tries must be a positive integer, not %r' % (config.max_tries,)
+   for field in ['max_evaluations', 'plateau_evaluations']:
+      if getattr(config, field) is not None and not is_count(getattr(config, field)):
+         return '%s must be a non-negative integer, not %r' % (field, getattr(config, field))
+   if config.time_budget is not None and (not is_number(config.time_budget) or config.time_budget < 0):
+      return 'time_budget must be a non-negative number of seconds, not %r' % (config.time_budget,)
+   if not isinstance(config.decryption_tests, (list, tuple)) or not config.decryption_tests:
+      return 'decryption_tests must be a list of (word length, top N) phases'
+   for decryption_test in config.decryption_tests:
+      if (not isinstance(decryption_test, (list, tuple)) or len(decryption_test) != 2
+          or not all(is_count(n) and n > 0 for n in decryption_test)):
+         return 'decryption test %r must be a word length and a top N, both positive integers' % (decryption_test,)
+   return None
+
+def parse_decryption_tests(phases):
+   """ Returns list of (word length, top N) tuples of a phase schedule written as length:top_n,..., such as
+   1:2,2:30,3:30, None if it is not written that way.  See check_search_config for the values allowed
+
+   Parameters
+   ----------
+   phases: string
+   """
+   try:
+      decryption_tests = [tuple(int(n) for n in phase.split(':')) for phase in phases.split(',') if phase]
+   except ValueError:
+      return None
+   if any(len(decryption_test) != 2 for decryption_test in decryption_tests): return None
+   return decryption_tests
+
+def parse_number(opt, arg, number_type):
+   """ Returns the value of a numeric command line option, converted by number_type, int or float.
+   Exits with a usage error if it is not a number of that type
+   """
+   try:
+      return number_type(arg)
+   except ValueError:
+      print '%s must be %s, not %s' % (opt, 'an integer' if number_type is int else 'a number', arg)
+      sys.exit(2)
+
+def read_search_config(path, config=DEFAULT_SEARCH_CONFIG):
+   """ Returns Search_Config of the config with the fields set in a json config file replaced,
+   None if the file can not be read, sets an unknown field or sets a value check_search_config rejects
+
+   Parameters
+   ----------
+   path: string
+   path of a json object such as {"tolerance": 0.9, "max_tries": 50, "decryption_tests": [[1, 2], [2, 30]]}
+
+   config: Search_Config, optional
+   """
+   data = read_json(path)
+   if not isinstance(data, dict):
+      print "search config %s must be a json object" % path
+      return None
+   unknown_fields = sorted(set(data) - set(Search_Config._fields))
+   if unknown_fields:
+      print "unknown search config fields in %s: %s, choose from: %s" % (path, ', '.join(unknown_fields), ', '.join(Search_Config._fields))
+      return None
+   if isinstance(data.get('decryption_tests'), list):
+      data['decryption_tests'] = [tuple(decryption_test) if isinstance(decryption_test, list) else decryption_test
+                                  for decryption_test in data['decryption_tests']]
+   config = config._replace(**dict((str(field), value) for field, value in data.iteritems()))
+   error = check_search_config(config)
+   if error:
+      print "search config %s: %s" % (path, error)
+      return None
+   return config
+
+class Search_Trace(object):
+   """ Search_Trace writes one json line per search phase to a file, see Phase_Trace
+
+   Lines are appended as each phase ends so the worker processes of a run can share one trace
+   """
+   def __init__(self, path):
+      self.path = path
+
+   def start_phase(self, engine, try_number, phase, best_score):
+      return Phase_Trace(self, engine, try_number, phase, best_score)
+
+   def write(self, record):
+      with open(self.path, 'a') as trace_file:
+         trace_file.write(json.dumps(record) + '\n')
+
+class Phase_Trace(object):
+   """ Phase_Trace counts the candidates scored and accepted in a phase of a search, the time spent scoring
+   them and the trajectory of the best score, as (number of candidates scored, best score) pairs
+   at each acceptance that raised it.  finish writes the record of the phase to its Search_Trace
+   """
+   def __init__(self, search_trace, engine, try_number, phase, best_score):
+      self.search_trace = search_trace
+      self.record = {'engine': engine, 'try': try_number, 'phase': phase, 'candidates': 0, 'accepted': 0,
+                     'scoring_seconds': 0.0, 'trajectory': [[0, best_score]]}
+      self.start_time = time.time()
+
+   def scored(self, number_of_candidates, seconds):
+      self.record['candidates'] += number_of_candidates
+      self.record['scoring_seconds'] += seconds
+
+   def accepted(self, best_score):
+      self.record['accepted'] += 1
+      if best_score > self.record['trajectory'][-1][1]:
+         self.record['trajectory'].append([self.record['candidates'], best_score])
+
+   def finish(self, ratio_of_words_found, **values):
+      self.record['seconds'] = time.time() - self.start_time
+      self.record['acceptance_rate'] = float(self.record['accepted']) / max(self.record['candidates'], 1)
+      self.record['best_score'] = self.record['trajectory'][-1][1]
+      self.record['ratio_of_words_found'] = ratio_of_words_found
+      self.record.update(values)
+      self.search_trace.write(self.record)
+
+def summarize_trace(path):
+   """ Returns list of dictionaries of the totals of each (engine, phase) of a trace file: the number of
+   restarts, candidates scored and accepted, acceptance rate, scoring and total seconds
+
+   Parameters
+   ----------
+   path: string
+   path of a trace file written by Search_Trace
+   """
+   totals = OrderedDict()
+   with open(path) as trace_file:
+      for line in trace_file:
+         record = json.loads(line)
+         phase_totals = totals.setdefault((record['engine'], record['phase']), {'engine': record['engine'], 'phase': record['phase'],
+                                          'restarts': 0, 'candidates': 0, 'accepted': 0, 'scoring_seconds': 0.0, 'seconds': 0.0})
+         phase_totals['restarts'] += 1
+         for key in ['candidates', 'accepted', 'scoring_seconds', 'seconds']:
+            phase_totals[key] += record[key]
+   for phase_totals in totals.itervalues():
+      phase_totals['acceptance_rate'] = float(phase_totals['accepted']) / max(phase_totals['candidates'], 1)
+   return sorted(totals.values(), key=lambda phase_totals: (phase_totals['engine'], phase_totals['phase']))
+
+def print_trace_summary(path):
+   print "engine      phase  restarts  candidates  acceptance  scoring s  total s"
+   for phase_totals in summarize_trace(path):
+      print "%-10s  %5d  %8d  %10d  %10.3f  %9.2f  %7.2f" % (phase_totals['engine'], phase_totals['phase'], phase_totals['restarts'],
+            phase_totals['candidates'], phase_totals['acceptance_rate'], phase_totals['scoring_seconds'], phase_totals['seconds'])
+
+def decrypt_try(try_number, state=None):
+   """ Returns the search engine result of one restart of run_decryption_iterations
+
+   The corpus, encrypted text and search settings are read from the state, or from decryption_state, which
+   is set before the worker processes are forked so that they share the loaded corpus instead of pickling it.
+   When a seed is set, restart try_number is seeded with seed + try_number so its result does not
+   depend on which process runs it.
+
+   Parameters
+   ----------
+   try_number: integer, counting from 0
+
+   state: tuple, optional
+   (corpus_obj, encrypted_text_obj, engine, options, seed), the default is decryption_state
+   """
+   corpus_obj, encrypted_text_obj, engine, options, seed = state or decryption_state
+   if seed is not None: random.seed(seed + try_number)
+   return SEARCH_ENGINES[engine](corpus_obj, encrypted_text_obj, try_number=try_number + 1, **options)
+
+def run_decryption_iterations(encrypted_text_obj, corpus_obj, tolerance=None, workers=1, seed=None, engine='hill_climb',
+                              deadline=None, cancel_event=None, progress=None, config=None, **options):   
+   """ Returns the decryption table of the first restart of the search engine to find more than the tolerance
+   ratio of words in the corpus, None if none of the config's max_tries restarts does.
+   If the deadline passes first the best decryption table found so far is returned, None if the search is cancelled
+
+   Parameters
+   ----------
+   encrypted_text_obj: object of Encrypted_Text Class
+
+   corpus_obj: object of Corpus class
+
+   tolerance: float, optional
+   Defaults to the tolerance of the config
+
+   workers: integer, optional
+   Number of processes the restarts are spread across.  Restarts are still judged in order and the
+   remaining ones are stopped once one passes the tolerance, so the result only depends on the seed
+
+   seed: integer, optional
+   Restart i is seeded with seed + i.  With several workers and no seed a random seed is drawn
+
+   engine: string, optional
+   Name of the search engine in SEARCH_ENGINES: hill_climb (decrypt) or anneal
+
+   options: keyword arguments passed on to the search engine, such as backend and block_size for decrypt
+   and schedule for anneal.  Each engine ignores the options of the others
+
+   deadline: float, optional
+   time.time() by which the search stops.  It is passed on to the engine, so the restart running at the
+   deadline returns its best key, which counts as a restart's result, and no restart follows
+
+   cancel_event: threading.Event, optional
+   The search stops and returns None after the restart during which the event is set
+
+   progress: function, optional
+   Called after each restart with the try number, counting from 1, the best decryption table so far
+   and its ratio of words found
+
+   config: Search_Config, optional
+   Thresholds and budgets of the search, the default is the module's search_config.  Its stop_ratio,
+   max_evaluations and plateau_evaluations are passed on to the engine unless the options set them,
+   its time_budget sets the deadline if none is given
+
+   With the hill_climb engine the restarts share a Score_Cache of score_cache_size keys unless the
+   options give one as score_cache, whose hits and misses can then be read after the run.  With several
+   workers each worker process has its own copy
+   """
+   global decryption_state
+   config = config or search_config
+   if tolerance is None: tolerance = config.tolerance
+   if deadline is None and config.time_budget is not None: deadline = time.time() + config.time_budget
+   options['deadline'] = deadline
+   for field in ['stop_ratio', 'max_evaluations', 'plateau_evaluations']:
+      options.setdefault(field, getattr(config, field))
+   if workers > 1 and seed is None: seed = random.getrandbits(32)
+   if engine == 'hill_climb' and not options.get('decryption_tests'):
+      options['decryption_tests'] = build_decryption_tests(corpus_obj, encrypted_text_obj, config.decryption_tests)
+   if engine == 'hill_climb' and 'score_cache' not in options and score_cache_size:
+      options['score_cache'] = Score_Cache(score_cache_size)
+   state = (corpus_obj, encrypted_text_obj, engine, options, seed)
+   if workers > 1:
+      # decryption jobs may start searches from several threads, the state must not change until the fork
+      with decryption_state_lock:
+         decryption_state = state
+         pool = multiprocessing.Pool(workers)
+      results = pool.imap(decrypt_try, range(config.max_tries))
+   else:
+      pool = None
+      results = (decrypt_try(i, state) for i in range(config.max_tries))
+   decrypt_map = None
+   try:
+      for i in range(config.max_tries): 
+         if pool is None: print "try # %d "  % (i+1)
+         try:
+            if pool is not None and deadline is not None:
+               decrypt_map_candidate, ratio_of_words_found_candidate = results.next(max(0, deadline - time.time()))
+            else:
+               decrypt_map_candidate, ratio_of_words_found_candidate = results.next()
+         except multiprocessing.TimeoutError:
+            print "deadline passed during try # %d" % (i+1)
+            return decrypt_map
+         if i == 0 or ratio_of_words_found_candidate > ratio_of_words_found_best:
             decrypt_map = decrypt_map_candidate
             ratio_of_words_found_best = ratio_of_words_found_candidate
-      if ratio_of_words_found_best > tolerance: 
-         print "high ratio of recognized words: %.2f%% , breaking from loop: " % (ratio_of_words_found_best *100)
-         return decrypt_map
-         break
+         if pool is not None: print "try # %d ratio: %.2f%%"  % (i+1, ratio_of_words_found_best * 100)
+         if progress: progress(i + 1, decrypt_map, ratio_of_words_found_best)
+         if ratio_of_words_found_best > tolerance: 
+            print "high ratio of recognized words: %.2f%% , breaking from loop: " % (ratio_of_words_found_best *100)
+            return decrypt_map
+         if cancel_event is not None and cancel_event.is_set():
+            print "decryption cancelled after try # %d" % (i+1)
+            return None
+         if deadline is not None and time.time() >= deadline:
+            print "deadline passed after try # %d, best ratio: %.2f%%" % (i+1, ratio_of_words_found_best * 100)
+            return decrypt_map
+   finally:
+      if pool is not None: pool.terminate()
    return None
 
+class Decryption_Job(object):
+   """ Decryption_Job runs run_decryption_iterations in a background thread so that a caller, such as a
+   service with response time limits, can follow its progress, cancel it or give it a time budget.
+   Python 2 has no asyncio, a thread and events stand in for an awaitable
+
+   Searches share the random module, so seeded jobs are only reproducible when they do not run at the
+   same time in one process, or when they run with several workers
+   """
+   def __init__(self, encrypted_text_obj, corpus_obj, time_budget=None, **options):
+      """ Starts the search, options are those of run_decryption_iterations
+
+      Parameters
+      ----------
+      time_budget: float, optional
+      Number of seconds after which the best decryption table found so far is returned
+      """
+      self.cancel_event = threading.Event()
+      self.done_event = threading.Event()
+      self.progress_queue = Queue.Queue()
+      self.decrypt_map = None
+      self.tries = 0
+      self.best_ratio_of_words_found = None
+      deadline = time.time() + time_budget if time_budget is not None else None
+      self.thread = threading.Thread(target=self.run, args=(encrypted_text_obj, corpus_obj, deadline, options))
+      self.thread.daemon = True
+      self.thread.start()
+
+   def run(self, encrypted_text_obj, corpus_obj, deadline, options):
+      try:
+         self.decrypt_map = run_decryption_iterations(encrypted_text_obj, corpus_obj, deadline=deadline,
+                                                      cancel_event=self.cancel_event, progress=self.report, **options)
+      except:
+         print 'Failure running decryption job'
+         traceback.print_exc()
+      finally:
+         self.done_event.set()
+         self.progress_queue.put(None)
+
+   def report(self, try_number, decrypt_map, ratio_of_words_found):
+      self.tries = try_number
+      self.best_ratio_of_words_found = ratio_of_words_found
+      self.progress_queue.put((try_number, ratio_of_words_found))
+
+   def iter_progress(self):
+      """ Yields (try number, best ratio of words found) tuples as restarts finish, until the job is done
+      """
+      while True:
+         item = self.progress_queue.get()
+         if item is None: return
+         yield item
+
+   def cancel(self):
+      """ Asks the search to stop after the current restart, the job result is then None
+      """
+      self.cancel_event.set()
+
+   def cancelled(self):
+      return self.cancel_event.is_set()
+
+   def done(self):
+      return self.done_event.is_set()
+
+   def result(self, timeout=None):
+      """ Returns the decryption table of the job once it is done, see run_decryption_iterations,
+      or None if it is not done within timeout seconds
+      """
+      self.done_event.wait(timeout)
+      return self.decrypt_map
+
+def find_encrypted_files(batch_source):
+   """ Returns sorted list of the paths of the encrypted files of a batch, or of the corpus files of --corpora
+
+   Parameters
+   ----------
+   batch_source: string
+   A directory, whose files are all taken, a manifest file listing one path per line, relative to the
+   directory of the manifest, with blank lines and lines starting with # skipped, or a glob pattern
+   """
+   if os.path.isdir(batch_source):
+      paths = [os.path.join(batch_source, name) for name in os.listdir(batch_source)]
+      return sorted(path for path in paths if os.path.isfile(path))
+   if os.path.isfile(batch_source):
+      return list(iter_manifest_paths(batch_source))
+   return sorted(glob.glob(batch_source))
+
+def iter_manifest_paths(manifest_path):
+   """ Yields the paths listed in a manifest file, see find_encrypted_files
+   """
+   manifest_directory = os.path.dirname(manifest_path)
+   with open(manifest_path) as manifest_file:
+      for line in manifest_file:
+         line = line.strip()
+         if line and not line.startswith('#'):
+            yield os.path.join(manifest_directory, line)
+
+def find_corpus_files(corpus_selection):
+   """ Returns list of the paths of the corpus files of --corpora, found as find_encrypted_files finds them,
+   except that a file is a manifest only if every path it lists is an existing file, otherwise it is
+   taken as the one corpus of the selection
+   """
+   if not os.path.isfile(corpus_selection):
+      return find_encrypted_files(corpus_selection)
+   paths = []
+   for path in iter_manifest_paths(corpus_selection):
+      if not os.path.isfile(path): return [corpus_selection]
+      paths.append(path)
+   return paths or [corpus_selection]
+
+def decrypt_file(encrypted_path):
+   """ Returns a tuple of the encrypted path and the decrypted path it was written to, None if the decryption
+   failed, for one file of run_batch_decryption.  The decrypted text and the cipher table are written to
+   the output directory as <name>-decoded.txt and <name>-cipher-table.txt, where name is the path of the file
+   relative to the directory holding all the files of the batch, so files of the same name do not collide
+   """
+   corpus_obj, output_directory, input_directory, tolerance, seed, use_pattern_key, engine, options = batch_state
+   try:
+      encrypted_text_obj = Encrypted_Text(encrypted_path)
+      initial_key = build_pattern_key(corpus_obj, encrypted_text_obj) if use_pattern_key else None
+      decrypt_map = run_decryption_iterations(encrypted_text_obj, corpus_obj, tolerance=tolerance, seed=seed, engine=engine,
+                                               initial_key=initial_key, **options)
+   except:
+      print 'Failure decrypting', encrypted_path
+      traceback.print_exc()
+      return encrypted_path, None
+   if not decrypt_map:
+      print "unsuccessful decryption of", encrypted_path
+      return encrypted_path, None
+   name = os.path.relpath(os.path.abspath(encrypted_path), input_directory)
+   decrypted_path = os.path.join(output_directory, name + '-decoded.txt')
+   encrypted_text_obj.write_decrypted(decrypt_map, decrypted_path)
+   write_decryption_cipher(decrypt_map, os.path.join(output_directory, name + '-cipher-table.txt'))
+   return encrypted_path, decrypted_path
+
+def run_batch_decryption(corpus_obj, encrypted_paths, output_directory, workers=1, tolerance=None, seed=None,
+                         use_pattern_key=False, engine='hill_climb', **options):
+   """ Returns list of (encrypted path, decrypted path) tuples, in the order of the encrypted paths, of decrypting
+   many encrypted files against one loaded corpus.  The decrypted path is None for files that failed,
+   see decrypt_file.  The number of files decrypted per second is printed at the end
+
+   Parameters
+   ----------
+   corpus_obj: object of Corpus class
+
+   encrypted_paths: list of strings, see find_encrypted_files
+
+   output_directory: string
+   Directory the decrypted texts and cipher tables are written to, created if needed
+
+   workers: integer, optional
+   Number of processes the files are spread across, each file's restarts run in one process.
+   The processes are forked after the corpus is loaded so they share it
+
+   tolerance, seed, engine, options: optional, see run_decryption_iterations.  Every file uses the same seed
+
+   use_pattern_key: Boolean, optional
+   If True each file's search starts from its build_pattern_key key
+   """
+   global batch_state
+   make_dir(output_directory)
+   directories = sorted(set(os.path.dirname(os.path.abspath(path)) for path in encrypted_paths))
+   # the files are written under their paths relative to the deepest directory holding them all
+   input_directory = os.sep.join(os.path.commonprefix([directory.split(os.sep) for directory in directories])) or os.sep
+   for directory in directories:
+      # created before the files are spread across processes, which would race to create them
+      make_dir(os.path.join(output_directory, os.path.relpath(directory, input_directory)))
+   batch_state = (corpus_obj, output_directory, input_directory, tolerance, seed, use_pattern_key, engine, options)
+   start_time = time.time()
+   if workers > 1:
+      pool = multiprocessing.Pool(workers)
+      try:
+         results = pool.map(decrypt_file, encrypted_paths)
+      finally:
+         pool.terminate()
+   else:
+      results = map(decrypt_file, encrypted_paths)
+   elapsed_time = time.time() - start_time
+   number_decrypted = len([decrypted_path for encrypted_path, decrypted_path in results if decrypted_path])
+   print "decrypted %d of %d files in %.1f seconds, %.2f files/sec" % (number_decrypted, len(results), elapsed_time,
+                                                                     len(results) / max(elapsed_time, 1e-9))
+   return results
+
 def main(argv):
    """ Corpus and encrypted text objects are created and we iterate of trials to find a decrytion key
-   until a good fit is found.  This "good fit" is hardcoded to be over 95% of words in the decrypted text
-   existing in the corpus.  It should be made into a configurable parameter
+   until a good fit is found.  This "good fit" is over 98% of words in the decrypted text existing in
+   the corpus by default, see --tolerance
 
-   200 trials will be performed if a good fit is not found and the best fit will be returned.
-   The 200 trial limit is an arbitrary and has never been reached in testing.
+   200 trials will be performed by default if a good fit is not found, see --max_tries.
+   The thresholds and budgets of the search can also be read from a json file, see --config
 
 
    Parameters to set input and output file, all optional
    _______________________________________
     -c <corpus_path>  
 
+    --corpora <directory, manifest, glob or corpus file>
+    Pick the corpus among these files: they are ranked by how close their letter frequencies and word
+    lengths are to those of the encrypted text, and the search is run against the best ones in turn
+    until a decryption is found.  A file that does not list existing files is a single corpus.  -c is ignored
+
+    --select <n>
+    Number of best ranked corpora of --corpora searched, the default is 2
+
     -e <encrypted_text_path> 
 
     -d <decrypted_text_path>  
 
-    -u   
-    If the u flag (usecache flag) is present the cached versions of parsed corpus data will be "u"sed instead of reparsing the corpus
-    If not set then corpus data will be reparsed from raw corpus text
+    -u
+    Ignored, kept for compatibility.  Built corpora are cached in the cache directory under a hash of the
+    corpus file and build settings, and are read from there whenever the hash matches
+
+    --cache_dir <directory>
+    Directory of the corpus caches, the default is data/corpus_cache
+
+    --cache_size <megabytes>
+    The least recently used corpus caches are removed once the caches take more than this, the default
+    is 1024.  0 turns the corpus cache off
+
+    -b <backend>
+    Scoring backend used to score candidate keys: incremental (default), numpy, full, progressive or logprob.
+    progressive scores swaps on a sample of the encrypted text and confirms them on the whole text,
+    for long texts.  logprob scores by the log probability of the decrypted ngrams, see --ngram
+
+    --block_size <n>
+    Number of candidate swaps proposed and scored together, the default is 1.  Use with the numpy backend
+
+    -w <n>
+    Number of worker processes the trials are spread across, the default is 1
+
+    --seed <n>
+    Random seed, trial i is seeded with n + i so runs can be reproduced with any number of workers
+
+    --chunk_size <n>
+    The corpus is built by streaming it in chunks of about n bytes, the default is 1 MB
+
+    --build_workers <n>
+    Build the corpus with n processes, each streaming and counting a shard of the corpus file
+
+    --ngram <n>
+    Size of the ngrams, 2 to 4, the logprob backend and the anneal engine score by, the default is 3.
+    Their smoothed log probability table is stored in the corpus cache
+
+    --pattern_key
+    Start each trial from a key built by matching the letter patterns of the longest and rarest
+    encrypted words to corpus words, instead of matching letters by frequency
+
+    --batch <directory, manifest or glob>
+    Decrypt many encrypted files against the corpus, which is loaded once: all files of a directory, the
+    files listed one per line in a manifest file, or the files matching a glob pattern.  -e and -d are
+    ignored and each file's decrypted text and cipher table are written to the output directory.
+    With -w the files are spread across the worker processes
+
+    --output_dir <directory>
+    Directory batch results are written to, the default is data/decoded
+
+    --score_cache_size <n>
+    Number of scored keys the hill climbing restarts of a run remember so they are not scored again,
+    the default is 100000 and 0 turns the cache off
+
+    --trace <path>
+    Write a json line per restart and phase of the search to the file: candidates scored, acceptance
+    rate, scoring time and best score trajectory, and print a summary per phase at the end
+
+    --config <path>
+    Json file of search settings, with any of the fields of Search_Config: tolerance, stop_ratio, max_tries,
+    decryption_tests, max_evaluations, plateau_evaluations and time_budget.  The flags below override it
+
+    --tolerance <ratio>
+    Ratio of words found in the corpus that ends the search, the default is 0.98
+
+    --stop_ratio <ratio>
+    Ratio of words found in the corpus that ends a trial, the default is 0.96
+
+    --max_tries <n>
+    Number of trials, the default is 200
+
+    --phases <length:top_n,...>
+    Phase schedule of the hill_climb engine: the word length and number of most frequent corpus words
+    whose letters are swapped in each phase, the default is 1:2,2:30,3:30,4:200,5:300
+
+    --max_evaluations <n>
+    Number of candidate keys a trial scores before it is cut off, the default is no limit
+
+    --plateau <n>
+    Number of candidate keys a trial scores without improving before it is cut off, the default is no limit
+
+    --time_budget <seconds>
+    The best decryption found when the time is up is returned, the default is no limit
+
+    --engine <name>
+    Search engine run on each trial: hill_climb (default) or anneal (simulated annealing)
+
+    --temperature <t>
+    Starting temperature of the anneal engine, per ngram of log10 probability
+
+    --cooling <r>
+    Factor the anneal engine's temperature is multiplied by at each step of its schedule
 
    """
-   global corpus_path, corpus_cache_path, encrypted_text_path, decrypted_text_path, use_corpus_cache
+   global corpus_path, corpus_cache_directory, corpus_cache_max_bytes, corpus_selection, number_of_selected_corpora, encrypted_text_path, decrypted_text_path, scoring_backend, swap_block_size, number_of_workers, random_seed, corpus_chunk_size, corpus_build_workers, search_engine, annealing_schedule, use_pattern_key, batch_source, batch_output_directory, score_cache_size, trace_path, search_config, ngram_size
    try:
-      opts, args = getopt.getopt(sys.argv[1:], 'hc:e:d:u', ["corpus=","encrypted=","decrypted=","use_cache"])
+      opts, args = getopt.getopt(sys.argv[1:], 'hc:e:d:ub:w:', ["corpus=","encrypted=","decrypted=","use_cache","backend=","block_size=","workers=","seed=","chunk_size=","build_workers=","engine=","temperature=","cooling=","pattern_key","batch=","output_dir=","score_cache_size=","trace=","ngram=","cache_dir=","cache_size=","corpora=","select=",
+                                                                  "config=","tolerance=","stop_ratio=","max_tries=","phases=","max_evaluations=","plateau=","time_budget="])
    except getopt.GetoptError:
-      print 'decipher.py -c <corpus_path> -e <encrypted_text_path> -d <decrypted_text_path> -u '
+      print 'decipher.py -c <corpus_path> -e <encrypted_text_path> -d <decrypted_text_path> -u -b <backend> -w <workers>'
       sys.exit(2)
+   for opt, arg in opts:
+      if opt == "--config":
+         search_config = read_search_config(arg, search_config)
+         if search_config is None: sys.exit(2)
    for opt, arg in opts:
       if opt == '-h':
-         print 'decipher.py -c <corpus_path> -e <encrypted_text_path> -d <decrypted_text_path> -u '
+         print 'decipher.py -c <corpus_path> -e <encrypted_text_path> -d <decrypted_text_path> -u -b <backend> -w <workers>'
          sys.exit()
       elif opt in ("-e", "--encrypted"):
          encrypted_text_path = arg
@@ -676,14 +3015,128 @@ def main(argv):
          decrypted_text_path = arg
       elif opt in ("-c", "--corpus"):
          corpus_path = arg
-      elif opt in ("-u", "--useCache"):
-         use_corpus_cache = True
+      elif opt in ("-u", "--use_cache"):
+         print '-u is ignored, corpus caches are always read from the cache directory, see --cache_dir and --cache_size'
+      elif opt == "--corpora":
+         corpus_selection = arg
+      elif opt == "--select":
+         number_of_selected_corpora = parse_number(opt, arg, int)
+         if number_of_selected_corpora < 1:
+            print 'the number of corpora searched must be at least 1, not %s' % arg
+            sys.exit(2)
+      elif opt == "--cache_dir":
+         corpus_cache_directory = arg
+      elif opt == "--cache_size":
+         corpus_cache_max_bytes = int(parse_number(opt, arg, float) * (1 << 20))
+      elif opt in ("-b", "--backend"):
+         if arg not in SCORING_BACKENDS:
+            print 'unknown scoring backend %s, choose from: %s' % (arg, ', '.join(sorted(SCORING_BACKENDS)))
+            sys.exit(2)
+         scoring_backend = arg
+      elif opt == "--block_size":
+         swap_block_size = parse_number(opt, arg, int)
+         if swap_block_size < 1:
+            print 'the block size must be at least 1 swap, not %s' % arg
+            sys.exit(2)
+      elif opt in ("-w", "--workers"):
+         number_of_workers = parse_number(opt, arg, int)
+      elif opt == "--seed":
+         random_seed = parse_number(opt, arg, int)
+      elif opt == "--chunk_size":
+         corpus_chunk_size = parse_number(opt, arg, int)
+      elif opt == "--build_workers":
+         corpus_build_workers = parse_number(opt, arg, int)
+      elif opt == "--trace":
+         trace_path = arg
+      elif opt == "--tolerance":
+         search_config = search_config._replace(tolerance=parse_number(opt, arg, float))
+      elif opt == "--stop_ratio":
+         search_config = search_config._replace(stop_ratio=parse_number(opt, arg, float))
+      elif opt == "--max_tries":
+         search_config = search_config._replace(max_tries=parse_number(opt, arg, int))
+      elif opt == "--phases":
+         decryption_tests = parse_decryption_tests(arg)
+         if decryption_tests is None:
+            print 'phases must be written length:top_n,..., such as 1:2,2:30,3:30, not %s' % arg
+            sys.exit(2)
+         search_config = search_config._replace(decryption_tests=decryption_tests)
+      elif opt == "--max_evaluations":
+         search_config = search_config._replace(max_evaluations=parse_number(opt, arg, int))
+      elif opt == "--plateau":
+         search_config = search_config._replace(plateau_evaluations=parse_number(opt, arg, int))
+      elif opt == "--time_budget":
+         search_config = search_config._replace(time_budget=parse_number(opt, arg, float))
+      elif opt == "--score_cache_size":
+         score_cache_size = parse_number(opt, arg, int)
+      elif opt == "--ngram":
+         if parse_number(opt, arg, int) not in NGRAM_SIZES:
+            print 'unknown ngram size %s, choose from: %s' % (arg, ', '.join(str(n) for n in NGRAM_SIZES))
+            sys.exit(2)
+         ngram_size = parse_number(opt, arg, int)
+      elif opt == "--batch":
+         batch_source = arg
+      elif opt == "--output_dir":
+         batch_output_directory = arg
+      elif opt == "--pattern_key":
+         use_pattern_key = True
+      elif opt == "--engine":
+         if arg not in SEARCH_ENGINES:
+            print 'unknown search engine %s, choose from: %s' % (arg, ', '.join(sorted(SEARCH_ENGINES)))
+            sys.exit(2)
+         search_engine = arg
+      elif opt == "--temperature":
+         annealing_schedule = annealing_schedule._replace(start_temperature=parse_number(opt, arg, float))
+      elif opt == "--cooling":
+         annealing_schedule = annealing_schedule._replace(cooling_rate=parse_number(opt, arg, float))
+
+   search_config_error = check_search_config(search_config)
+   if search_config_error:
+      print 'invalid search settings: %s' % search_config_error
+      sys.exit(2)
 
    make_dir(data_directory)
+   corpus_registry = Corpus_Registry(corpus_cache_directory, corpus_cache_max_bytes)
+   trace = None
+   if trace_path:
+      open(trace_path, 'w').close()
+      trace = Search_Trace(trace_path)
+
+   if batch_source:
+      corpus_obj = corpus_registry.load(corpus_path, chunk_size=corpus_chunk_size, build_workers=corpus_build_workers, ngram_size=ngram_size)
+      run_batch_decryption(corpus_obj, find_encrypted_files(batch_source), batch_output_directory, workers=number_of_workers,
+                           seed=random_seed, use_pattern_key=use_pattern_key, engine=search_engine, backend=scoring_backend,
+                           block_size=swap_block_size, schedule=annealing_schedule, trace=trace)
+      if trace: print_trace_summary(trace_path)
+      return
 
    encrypted_text_obj = Encrypted_Text(encrypted_text_path)
-   corpus_obj = Corpus(corpus_path, use_corpus_cache)
-   decrypt_map = run_decryption_iterations(encrypted_text_obj, corpus_obj)
+   if corpus_selection:
+      corpus_paths = find_corpus_files(corpus_selection)
+      if not corpus_paths:
+         print 'no corpus files found in %s' % corpus_selection
+         sys.exit(2)
+      corpora = dict((path, corpus_registry.load(path, chunk_size=corpus_chunk_size, build_workers=corpus_build_workers, ngram_size=ngram_size))
+                     for path in corpus_paths)
+      ranking = rank_corpora(encrypted_text_obj, corpora)
+      for distance, path in ranking:
+         print 'corpus fingerprint distance %.3f: %s' % (distance, path)
+      selected_corpora = [corpora[path] for distance, path in ranking[:number_of_selected_corpora]]
+   else:
+      selected_corpora = [corpus_registry.load(corpus_path, chunk_size=corpus_chunk_size, build_workers=corpus_build_workers, ngram_size=ngram_size)]
+   decrypt_map = None
+   for corpus_obj in selected_corpora:
+      print 'searching against corpus', corpus_obj.filepath
+      initial_key = build_pattern_key(corpus_obj, encrypted_text_obj) if use_pattern_key else None
+      # scores depend on the corpus, so each corpus has its own score cache
+      score_cache = Score_Cache(score_cache_size) if search_engine == 'hill_climb' and score_cache_size else None
+      decrypt_map = run_decryption_iterations(encrypted_text_obj, corpus_obj, workers=number_of_workers, seed=random_seed,
+                                               engine=search_engine, backend=scoring_backend, block_size=swap_block_size,
+                                               schedule=annealing_schedule, initial_key=initial_key, trace=trace,
+                                               score_cache=score_cache)
+      # worker processes fill copies of the cache, whose counters are not sent back
+      if score_cache is not None and number_of_workers == 1: print score_cache.summary()
+      if decrypt_map: break
+   if trace: print_trace_summary(trace_path)
 
    if decrypt_map:
       print encrypted_text_obj.translate(decrypt_map)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys, getopt, time
+import json
+import multiprocessing
+import traceback
+import BaseHTTPServer
+import SocketServer
+import decipher as dc
+
+host = '127.0.0.1'
+port = 8642
+corpus_paths = {}
+corpus_cache_directory = dc.corpus_cache_directory
+corpus_cache_max_bytes = dc.CORPUS_CACHE_MAX_BYTES
+number_of_workers = 1
+
+# corpora by name, set before the worker pool is forked so the workers share them
+corpora = {}
+
+
+class Decryption_Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+   """ Decryption_Server is an HTTP server that handles each request in its own thread and runs the
+   decryptions on a pool of worker processes, so a request only waits for its own search
+
+   """
+   daemon_threads = True
+
+   def __init__(self, server_address, workers=1):
+      BaseHTTPServer.HTTPServer.__init__(self, server_address, Decryption_Request_Handler)
+      self.pool = multiprocessing.Pool(workers)
+
+   def server_close(self):
+      BaseHTTPServer.HTTPServer.server_close(self)
+      self.pool.terminate()
+
+class Decryption_Request_Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+   """ Handles the requests of the Decryption_Server
+
+   GET /corpora returns the names of the loaded corpora
+   POST /decrypt takes a json object with the encrypted text and optional settings, see check_request,
+   and returns a json object with the decrypt_map, ratio_of_words_found, plaintext and corpus, see decrypt_request
+   """
+   def do_GET(self):
+      if self.path == '/corpora':
+         self.send_json(200, {'corpora': sorted(corpora)})
+      else:
+         self.send_json(404, {'error': 'unknown path %s' % self.path})
+
+   def do_POST(self):
+      if self.path != '/decrypt':
+         self.send_json(404, {'error': 'unknown path %s' % self.path})
+         return
+      try:
+         request = json.loads(self.rfile.read(int(self.headers.getheader('content-length', 0))))
+      except ValueError:
+         self.send_json(400, {'error': 'request is not valid json'})
+         return
+      error = check_request(request)
+      if error:
+         self.send_json(400, {'error': error})
+         return
+      try:
+         response = self.server.pool.apply(decrypt_request, (request,))
+      except:
+         traceback.print_exc()
+         self.send_json(500, {'error': 'decryption failed'})
+         return
+      self.send_json(422 if 'error' in response else 200, response)
+
+   def send_json(self, status, data):
+      body = json.dumps(data)
+      self.send_response(status)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+
+def load_corpora(corpus_paths, corpus_registry=None):
+   """ Returns dictionary of Corpus objects by name, with the word indexes and fingerprints the searches use already built
+
+   The corpora are read from the caches of the registry, or built and cached there if their files changed
+
+   Parameters
+   ----------
+   corpus_paths: dictionary of corpus file paths by name
+
+   corpus_registry: Corpus_Registry object, optional
+   The default is a registry of decipher's corpus cache directory
+   """
+   corpus_registry = corpus_registry or dc.Corpus_Registry()
+   loaded_corpora = {}
+   for name, path in corpus_paths.iteritems():
+      corpus_obj = corpus_registry.load(path)
+      corpus_obj.build_words_by_length()
+      corpus_obj.build_word_patterns()
+      corpus_obj.build_fingerprint()
+      loaded_corpora[name] = corpus_obj
+   return loaded_corpora
+
+def check_request(request):
+   """ Returns an error message if the decryption request is not valid, None if it is
+
+   A request is a dictionary with keys:
+     text: the encrypted text, required
+     corpus: name of the corpus, optional.  If it is not given the corpus whose fingerprint is closest to
+             that of the text is used, see decipher.rank_corpora
+     seed, tolerance: optional, see decipher.run_decryption_iterations
+     engine: optional, name of the search engine in decipher.SEARCH_ENGINES
+     pattern_key: optional, if true the search starts from decipher.build_pattern_key
+     time_budget: optional, number of seconds after which the best decryption found so far is returned
+   """
+   if not isinstance(request, dict) or not isinstance(request.get('text'), basestring):
+      return 'request must be a json object with the encrypted text'
+   if request.get('corpus') is not None and request['corpus'] not in corpora:
+      return 'unknown corpus %s' % request['corpus']
+   if request.get('engine', 'hill_climb') not in dc.SEARCH_ENGINES:
+      return 'unknown search engine %s' % request['engine']
+   # json true and false are bools, which are ints to isinstance
+   is_number = lambda value: isinstance(value, (int, long, float)) and not isinstance(value, bool)
+   if not is_number(request.get('time_budget', 0)) or request.get('time_budget', 0) < 0:
+      return 'time_budget must be a non-negative number of seconds'
+   if not is_number(request.get('tolerance', 0)) or not 0 <= request.get('tolerance', 0) <= 1:
+      return 'tolerance must be a ratio of words found, between 0 and 1'
+   if not is_number(request.get('seed', 0)) or isinstance(request.get('seed', 0), float):
+      return 'seed must be an integer'
+   return None
+
+def decrypt_request(request):
+   """ Returns dictionary response to a decryption request, run in a worker process of the server
+   The response has the decrypt_map, as a dictionary of the decrypted letter of each encrypted uppercase
+   letter, the ratio_of_words_found, the plaintext and the name of the corpus, or an error if the decryption
+   was unsuccessful
+   """
+   deadline = time.time() + request['time_budget'] if request.get('time_budget') is not None else None
+   encrypted_text_obj = dc.Encrypted_Text(None, request['text'])
+   corpus_name = request.get('corpus') or dc.rank_corpora(encrypted_text_obj, corpora)[0][1]
+   corpus_obj = corpora[corpus_name]
+   initial_key = dc.build_pattern_key(corpus_obj, encrypted_text_obj) if request.get('pattern_key') else None
+   decrypt_map = dc.run_decryption_iterations(encrypted_text_obj, corpus_obj, tolerance=request.get('tolerance'),
+                                              seed=request.get('seed'), engine=request.get('engine', 'hill_climb'),
+                                              initial_key=initial_key, deadline=deadline)
+   if not decrypt_map:
+      return {'error': 'unsuccessful decryption'}
+   return {'decrypt_map': dict((letter, letter.translate(decrypt_map)) for letter in dc.UPPERCASE_ASCII),
+           'ratio_of_words_found': dc.score_decryption(corpus_obj, encrypted_text_obj, decrypt_map)[1],
+           'plaintext': encrypted_text_obj.translate(decrypt_map), 'corpus': corpus_name}
+
+def build_server(loaded_corpora, server_address=(host, port), workers=1):
+   """ Returns Decryption_Server serving the corpora.  The worker pool is forked after the corpora are set
+   so every worker shares the loaded corpora
+
+   Parameters
+   ----------
+   loaded_corpora: dictionary of Corpus objects by name, see load_corpora
+
+   server_address: (host, port) tuple, optional
+
+   workers: integer, optional
+   Number of decryptions run at the same time
+   """
+   global corpora
+   corpora = loaded_corpora
+   return Decryption_Server(server_address, workers)
+
+def main(argv):
+   """ Loads the corpora and serves decryption requests until interrupted
+
+   Parameters, all optional
+   _______________________________________
+    -c <name>=<corpus_path>
+    Corpus to load, may be repeated.  A path without a name is loaded as the default corpus.
+    The default is decipher.py's default corpus
+
+    -u
+    Ignored, kept for compatibility.  The corpora are always read from the corpus cache directory when it has them
+
+    --cache_dir <directory>, --cache_size <megabytes>
+    Corpus cache directory and the size it is kept under, see decipher.py
+
+    -w <n>
+    Number of worker processes running decryptions, the default is 1
+
+    --host <host>, --port <port>
+    Address to listen on, the default is 127.0.0.1:8642
+
+   """
+   global host, port, corpus_cache_directory, corpus_cache_max_bytes, number_of_workers
+   try:
+      opts, args = getopt.getopt(argv[1:], 'hc:uw:', ["corpus=","use_cache","workers=","host=","port=","cache_dir=","cache_size="])
+   except getopt.GetoptError:
+      print 'server.py -c <name>=<corpus_path> -u -w <workers> --host <host> --port <port>'
+      sys.exit(2)
+   for opt, arg in opts:
+      if opt == '-h':
+         print 'server.py -c <name>=<corpus_path> -u -w <workers> --host <host> --port <port>'
+         sys.exit()
+      elif opt in ("-c", "--corpus"):
+         name, path = arg.split('=', 1) if '=' in arg else ('default', arg)
+         corpus_paths[name] = path
+      elif opt in ("-u", "--use_cache"):
+         print '-u is ignored, corpus caches are always read from the cache directory, see --cache_dir and --cache_size'
+      elif opt in ("-w", "--workers"):
+         number_of_workers = int(arg)
+      elif opt == "--host":
+         host = arg
+      elif opt == "--port":
+         port = int(arg)
+      elif opt == "--cache_dir":
+         corpus_cache_directory = arg
+      elif opt == "--cache_size":
+         corpus_cache_max_bytes = int(float(arg) * (1 << 20))
+
+   corpus_registry = dc.Corpus_Registry(corpus_cache_directory, corpus_cache_max_bytes)
+   server = build_server(load_corpora(corpus_paths or {'default': dc.corpus_path}, corpus_registry), (host, port), number_of_workers)
+   print 'serving decryptions on %s:%d' % (host, port)
+   try:
+      server.serve_forever()
+   except KeyboardInterrupt:
+      pass
+   finally:
+      server.server_close()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -3,8 +3,11 @@
 
 import unittest
 import decipher
+import server
+import benchmark
 
-import os, shutil, sys, random
+import os, shutil, sys, random, re, glob, time
+import json, threading, urllib2, StringIO
 from collections import Counter
 
 TEST_DATA_DIR = 'tmp_tests'
@@ -30,6 +33,18 @@ def setup():
 
 
 
+def regex_normalize_text(text, remove_nonwords=False):
+   """ Returns text normalized, without stripping, by the regular expressions normalize_text used to apply,
+   the reference of the normalize_text and normalize_corpus_piece parity test
+   """
+   if remove_nonwords: text = re.sub(ur'[\S]*[\.\:\_0-9]+[\S]*', '', text, flags=re.UNICODE|re.MULTILINE)
+   text =  text.upper()
+   text = re.sub(u"[^a-z,^A-Z,\s\.\,\-^'^\u2019]", ' ', text, flags=re.UNICODE)
+   text = re.sub(u"[\s,\.\|_]+",' ', text)
+   text = re.sub(ur'([^\s\w])+', '',text)
+   return text
+
+
 class TestDecipherMethods(unittest.TestCase):
    # 
    '''
@@ -85,11 +100,33 @@ write_decryption_cipher
    	  result = decipher.read_json(test_data_path)
    	  self.assertEqual(test_dict, result)
 
+   def test_normalize_corpus_pieces(self):
+      text = u'one, two - three\r\nfour.txt five\xa0six  seven'
+      pieces = [text[:5], text[5:11], text[11:]]
+      self.assertEqual(decipher.find_clean_cut(text), 11)
+      self.assertEqual(u''.join(decipher.normalize_corpus_piece(piece) for piece in pieces).strip(),
+                       decipher.normalize_text(decipher.remove_nonwords(text)))
+
+   def test_normalize_parity(self):
+       texts = [decipher.read_textfile(path) for path in glob.glob(os.path.join(decipher.data_directory, 'tests', '*'))]
+       texts.append(u'Caf\xe9 \u0131n A\xa0-\xa0B, \x1cC\x85D | e_f 1.2 don\u2019t ^x^ \t\n. end. 3rd \x01\x1c\x04,.')
+       characters = u''.join(unichr(code) for code in range(0x3000))
+       texts += [characters[i:i+5] for i in range(0, len(characters), 5)]
+       rng = random.Random(1)
+       pool = list(u"aZ \t\n\xa0\x1c.:_09,|^-'\u2019\xe9\u0131\x85!") + [u' '] * 4
+       texts += [u''.join(rng.choice(pool) for i in range(rng.randint(0, 12))) for t in range(3000)]
+       for text in texts:
+          self.assertEqual(decipher.normalize_unstripped_text(text), regex_normalize_text(text))
+          self.assertEqual(decipher.normalize_corpus_piece(text), regex_normalize_text(text, remove_nonwords=True))
+          normalized_text = decipher.normalize_text(text)
+          self.assertEqual(normalized_text.split() or [u''], re.split(ur'[\s\.\,\-]*', normalized_text, flags=re.UNICODE))
+
    def test_filter_by_size(self):
    	  test_data= Counter({'one':1, 'two':33, 'three':2})
    	  result = decipher.filter_by_size(test_data,3)
    	  expected_result = Counter({'one':1, 'two':33})
    	  self.assertEqual(result, expected_result) 
+   	  self.assertEqual(decipher.filter_by_size(test_data,3,1), Counter({'two':33}))
 
    def test_shuffle_keys(self):
    	  key_list = ['a','b','c','d','e']
@@ -139,6 +176,487 @@ class TestEncryptedTextObjectMethods(unittest.TestCase):
        expected_result = 'WHEN'
        self.assertEqual(actual_result, expected_result) 
 
+class TestScorerMethods(unittest.TestCase):
+   def setUp(self):
+       self.corpus_obj = decipher.Corpus(os.path.join(decipher.data_directory,'tests','test_quotes.txt'), cache_path = None)
+       self.encrypted_text_obj = decipher.Encrypted_Text(os.path.join(decipher.data_directory,'tests','test_quotes.txt-123'))
+       self.cypher_key_alphabet_list = self.encrypted_text_obj.letters_by_frequency
+       self.corpus_alphabet_list = self.corpus_obj.letters_by_frequency
+
+   def full_score(self, corpus_alphabet_list):
+       decrypt_map = decipher.build_decrypt_map(self.cypher_key_alphabet_list, corpus_alphabet_list)
+       return decipher.score_decryption(self.corpus_obj, self.encrypted_text_obj, decrypt_map)
+
+   def test_incremental_scorer(self):
+       scorer = decipher.Incremental_Scorer(self.corpus_obj, self.encrypted_text_obj, self.cypher_key_alphabet_list, self.corpus_alphabet_list)
+       random.seed(1)
+       for t in range(200):
+          index1, index2 = random.randrange(26), random.randrange(26)
+          test_corpus_alphabet_list = scorer.corpus_alphabet_list[ : ]
+          test_corpus_alphabet_list[index1], test_corpus_alphabet_list[index2] = test_corpus_alphabet_list[index2], test_corpus_alphabet_list[index1]
+          self.assertEqual(scorer.score_swap(index1, index2), self.full_score(test_corpus_alphabet_list))
+          if t % 2:
+             scorer.apply_swap(index1, index2)
+             self.assertEqual(scorer.score(), self.full_score(scorer.corpus_alphabet_list))
+
+   def test_progressive_scorer(self):
+       random.seed(1)
+       sample_scorer = decipher.Sample_Scorer(self.corpus_obj, self.encrypted_text_obj, self.cypher_key_alphabet_list, self.corpus_alphabet_list, 10 ** 6)
+       self.assertEqual(sample_scorer.score(), self.full_score(self.corpus_alphabet_list))
+       scorer = decipher.Progressive_Scorer(self.corpus_obj, self.encrypted_text_obj, self.cypher_key_alphabet_list, self.corpus_alphabet_list, sample_size=50)
+       self.assertEqual(scorer.sample_scorer.number_of_words, 50)
+       for t in range(200):
+          index1, index2 = random.randrange(26), random.randrange(26)
+          test_corpus_alphabet_list = scorer.corpus_alphabet_list[ : ]
+          test_corpus_alphabet_list[index1], test_corpus_alphabet_list[index2] = test_corpus_alphabet_list[index2], test_corpus_alphabet_list[index1]
+          scores = scorer.score_swap(index1, index2)
+          if scores[0] > float('-inf'):
+             self.assertEqual(scores, self.full_score(test_corpus_alphabet_list))
+             scorer.apply_swap(index1, index2)
+          self.assertEqual(scorer.score(), self.full_score(scorer.corpus_alphabet_list))
+       for t in range(decipher.PROGRESSIVE_WINDOW + 1):
+          scorer.score_swap(0, 0)
+       self.assertEqual(scorer.sample_size, 100)
+       sample_scorer = scorer.sample_scorer
+       for t in range(decipher.PROGRESSIVE_WINDOW + 1):
+          scorer.score_swap(0, 0)
+          scorer.apply_swap(0, 0)
+       self.assertEqual(scorer.sample_size, 100)
+       self.assertIs(scorer.sample_scorer, sample_scorer)
+       random.seed(3)
+       decrypt_map, ratio_of_words_found = decipher.decrypt(self.corpus_obj, self.encrypted_text_obj, backend='progressive', score_cache=decipher.Score_Cache())
+       self.assertGreater(ratio_of_words_found, 0.9)
+
+   @unittest.skipIf(decipher.numpy is None, 'numpy is not installed')
+   def test_numpy_scorer(self):
+       scorer = decipher.Numpy_Scorer(self.corpus_obj, self.encrypted_text_obj, self.cypher_key_alphabet_list, self.corpus_alphabet_list)
+       random.seed(1)
+       for t in range(50):
+          test_corpus_alphabet_list = self.corpus_alphabet_list[ : ]
+          random.shuffle(test_corpus_alphabet_list)
+          self.assertEqual(scorer.score_key(test_corpus_alphabet_list), self.full_score(test_corpus_alphabet_list))
+
+   @unittest.skipIf(decipher.numpy is None, 'numpy is not installed')
+   def test_score_decryption_batch(self):
+       random.seed(3)
+       keys = [random.sample(range(26), 26) for t in range(20)]
+       composite_scores, ratios_of_words_found = decipher.score_decryption_batch(self.corpus_obj, self.encrypted_text_obj, keys)
+       for key, composite_score, ratio_of_words_found in zip(keys, composite_scores, ratios_of_words_found):
+          decrypt_map = decipher.build_decrypt_map(list(decipher.UPPERCASE_ASCII), [decipher.UPPERCASE_ASCII[i] for i in key])
+          expected_result = decipher.score_decryption(self.corpus_obj, self.encrypted_text_obj, decrypt_map)
+          self.assertEqual((composite_score, ratio_of_words_found), expected_result)
+
+   def test_word_code(self):
+       self.assertEqual(decipher.word_code('A'), 1)
+       self.assertEqual(decipher.word_code('BA'), 2 + 1 * 27)
+
+   def test_run_decryption_iterations_seeded(self):
+       decrypt_map = decipher.run_decryption_iterations(self.encrypted_text_obj, self.corpus_obj, tolerance=0.9, seed=7)
+       decrypt_map_workers = decipher.run_decryption_iterations(self.encrypted_text_obj, self.corpus_obj, tolerance=0.9, workers=2, seed=7)
+       self.assertTrue(decrypt_map)
+       self.assertEqual(decrypt_map, decrypt_map_workers)
+
+   def test_anneal(self):
+       scorer = decipher.Log_Probability_Scorer(self.corpus_obj, self.encrypted_text_obj, self.encrypted_text_obj.letters_by_frequency, self.corpus_obj.letters_by_frequency)
+       fitness, ratio_of_words_found = scorer.score_swap(0, 5)
+       scorer.apply_swap(0, 5)
+       self.assertAlmostEqual(scorer.score()[0], fitness)
+       scorer.reset(scorer.corpus_alphabet_list[ : ])
+       self.assertAlmostEqual(scorer.score()[0], fitness)
+       decipher.random.seed(3)
+       decrypt_map, ratio_of_words_found = decipher.anneal(self.corpus_obj, self.encrypted_text_obj, schedule=decipher.Annealing_Schedule(0.02, 0.8, 300, 0.0005))
+       self.assertGreater(ratio_of_words_found, 0.9)
+       self.assertTrue(self.encrypted_text_obj.translate(decrypt_map, False).startswith(u'WHEN YOU COME TO A FORK IN THE ROAD'))
+
+   def test_ngram_log_probabilities(self):
+       whole_corpus_obj = decipher.Corpus(self.corpus_obj.filepath, cache_path = None, keep_text = True, ngram_size = 4)
+       streamed_corpus_obj = decipher.Corpus(self.corpus_obj.filepath, cache_path = None, chunk_size = 64, build_workers = 2, ngram_size = 4)
+       self.assertEqual(streamed_corpus_obj.ngram_counts[4], decipher.divide_ngrams(whole_corpus_obj.normalized_text, 4))
+       self.assertEqual(streamed_corpus_obj.trigrams, whole_corpus_obj.trigrams)
+       log_probabilities = streamed_corpus_obj.build_ngram_log_probabilities()
+       self.assertAlmostEqual(sum(10 ** log_probability for log_probability in log_probabilities.table), 1.0)
+       self.assertGreater(log_probabilities[u'THE '], log_probabilities[u'QQQQ'])
+       scorer = decipher.Log_Probability_Scorer(streamed_corpus_obj, self.encrypted_text_obj, self.cypher_key_alphabet_list, self.corpus_alphabet_list)
+       fitness, ratio_of_words_found = scorer.score_swap(0, 5)
+       scorer.apply_swap(0, 5)
+       scorer.reset(scorer.corpus_alphabet_list[ : ])
+       self.assertAlmostEqual(scorer.score()[0], fitness)
+       test_data_dir = build_test_dir_path()
+       decipher.make_dir(test_data_dir)
+       cache_path = os.path.join(test_data_dir, 'corpus_cache.bin')
+       self.assertTrue(decipher.write_corpus_cache(streamed_corpus_obj, cache_path))
+       cached_corpus_obj = decipher.Corpus(self.corpus_obj.filepath, use_cache = True, cache_path = cache_path, ngram_size = 4)
+       self.assertIsNotNone(cached_corpus_obj.corpus_cache)
+       self.assertEqual(list(cached_corpus_obj.build_ngram_log_probabilities().table), list(log_probabilities.table))
+       self.assertTrue(cached_corpus_obj.corpus_cache.has_ngram_table(3))
+       # the cache has no bigram table so the corpus is counted again
+       cached_corpus_obj = decipher.Corpus(self.corpus_obj.filepath, use_cache = True, cache_path = cache_path, ngram_size = 2)
+       self.assertIsNone(cached_corpus_obj.corpus_cache)
+       self.assertEqual(cached_corpus_obj.ngram_counts[2], decipher.divide_ngrams(whole_corpus_obj.normalized_text, 2))
+       random.seed(3)
+       decrypt_map, ratio_of_words_found = decipher.decrypt(streamed_corpus_obj, self.encrypted_text_obj, backend='logprob')
+       self.assertGreater(ratio_of_words_found, 0.9)
+
+   def test_build_pattern_key(self):
+       self.assertEqual(decipher.word_pattern(u'THAT'), u'ABCA')
+       self.assertEqual(decipher.word_pattern(u'HIGH'), u'ABCA')
+       word_patterns = decipher.build_word_index(Counter({u'THAT': 2, u'HIGH': 5, u'FORK': 1}), decipher.word_pattern)
+       self.assertEqual(word_patterns, {u'ABCA': [u'HIGH', u'THAT'], u'ABCD': [u'FORK']})
+       words_by_length = self.corpus_obj.build_words_by_length()
+       self.assertEqual(words_by_length.get(3, [], 4), sorted(decipher.filter_by_size(self.corpus_obj.corpus_dict, 3), key=lambda word: (-self.corpus_obj.corpus_dict[word], word))[:4])
+       initial_key = decipher.build_pattern_key(self.corpus_obj, self.encrypted_text_obj)
+       self.assertEqual(sorted(initial_key), sorted(self.corpus_obj.letters_by_frequency))
+       decrypt_map = decipher.build_decrypt_map(self.encrypted_text_obj.letters_by_frequency, initial_key)
+       self.assertTrue(self.encrypted_text_obj.translate(decrypt_map, False).startswith(u'WHEN YOU COME TO A FORK IN THE ROAD'))
+
+   def test_run_batch_decryption(self):
+       test_data_dir = build_test_dir_path()
+       decipher.make_dir(test_data_dir)
+       quotes_dir = os.path.dirname(self.encrypted_text_obj.filepath)
+       self.assertEqual(decipher.find_encrypted_files(os.path.join(quotes_dir, 'test_quotes.txt-*5*')),
+                        [os.path.join(quotes_dir, name) for name in ['test_quotes.txt-23556', 'test_quotes.txt-455454', 'test_quotes.txt-55555']])
+       manifest_path = os.path.join(test_data_dir, 'manifest.txt')
+       decipher.write_file(u'# quotes\n../../data/tests/test_quotes.txt-123\n\n../../data/tests/test_quotes.txt-55555\n', manifest_path, encoding='utf-8')
+       encrypted_paths = decipher.find_encrypted_files(manifest_path)
+       self.assertEqual(map(os.path.basename, encrypted_paths), ['test_quotes.txt-123', 'test_quotes.txt-55555'])
+       output_dir = os.path.join(test_data_dir, 'decoded')
+       results = decipher.run_batch_decryption(self.corpus_obj, encrypted_paths, output_dir, workers=2, tolerance=0.9, seed=7)
+       self.assertEqual([encrypted_path for encrypted_path, decrypted_path in results], encrypted_paths)
+       for encrypted_path, decrypted_path in results:
+          self.assertTrue(decipher.read_textfile(decrypted_path).startswith(u'When you come to a fork in the road'))
+          self.assertTrue(os.path.exists(os.path.join(output_dir, os.path.basename(encrypted_path) + '-cipher-table.txt')))
+       # files of the same name from different directories are written under their relative paths
+       same_name_paths = [os.path.join(test_data_dir, 'batch', directory, 'x.txt') for directory in ['a', 'b']]
+       for path in same_name_paths:
+          decipher.make_dir(os.path.dirname(path))
+          shutil.copy(encrypted_paths[0], path)
+       results = decipher.run_batch_decryption(self.corpus_obj, same_name_paths, output_dir, tolerance=0.9, seed=7)
+       self.assertEqual([decrypted_path for encrypted_path, decrypted_path in results],
+                        [os.path.join(output_dir, directory, 'x.txt-decoded.txt') for directory in ['a', 'b']])
+       self.assertTrue(all(os.path.exists(decrypted_path) for encrypted_path, decrypted_path in results))
+
+   def test_decryption_job(self):
+       job = decipher.Decryption_Job(self.encrypted_text_obj, self.corpus_obj, time_budget=0.5, tolerance=1.0, seed=7)
+       progress = list(job.iter_progress())
+       self.assertTrue(job.done())
+       self.assertEqual(progress[0][0], 1)
+       self.assertEqual(job.tries, len(progress))
+       self.assertLess(len(progress), 200)
+       self.assertTrue(self.encrypted_text_obj.translate(job.result(), False).startswith(u'WHEN YOU COME TO A FORK IN THE ROAD'))
+       job = decipher.Decryption_Job(self.encrypted_text_obj, self.corpus_obj, tolerance=1.0, seed=7)
+       job.iter_progress().next()
+       job.cancel()
+       self.assertIsNone(job.result(60))
+       self.assertTrue(job.done() and job.cancelled())
+       self.assertLess(job.tries, 200)
+       # the restart running at the deadline is stopped, not only the restarts after it
+       long_encrypted_text_obj = decipher.Encrypted_Text(None, self.encrypted_text_obj.raw_text * 20)
+       start_time = time.time()
+       job = decipher.Decryption_Job(long_encrypted_text_obj, self.corpus_obj, time_budget=0.2, backend='full', tolerance=1.0)
+       self.assertIsNotNone(job.result(60))
+       self.assertLess(time.time() - start_time, 2)
+       self.assertEqual(job.tries, 1)
+
+   def test_compact_key(self):
+       corpus_alphabet_list = self.corpus_obj.letters_by_frequency
+       scorer = decipher.Incremental_Scorer(self.corpus_obj, self.encrypted_text_obj, self.encrypted_text_obj.letters_by_frequency, corpus_alphabet_list)
+       self.assertEqual(str(scorer.key), ''.join(corpus_alphabet_list))
+       swapped_key = scorer.swapped_key(0, 3)
+       self.assertEqual(str(scorer.key), ''.join(corpus_alphabet_list))
+       scorer.apply_swap(0, 3)
+       self.assertEqual(str(scorer.key), swapped_key)
+       self.assertEqual(scorer.build_decrypt_map(), decipher.build_decrypt_map(self.encrypted_text_obj.letters_by_frequency, list(swapped_key)))
+       test_data_dir = build_test_dir_path()
+       decipher.make_dir(test_data_dir)
+       cipher_path = os.path.join(test_data_dir, 'cipher-table.txt')
+       self.assertTrue(decipher.write_decryption_cipher(decipher.build_decrypt_map([u'A', u'B'], [u'B', u'A']), cipher_path))
+       self.assertEqual(open(cipher_path).read().split('\r\n')[:3], ['a -> b', 'b -> a', 'c -> c'])
+
+   def test_score_cache(self):
+       score_cache = decipher.Score_Cache(max_size=2)
+       score_cache.put(u'A', (1.0, 0.5))
+       score_cache.put(u'B', (2.0, 0.5))
+       self.assertEqual(score_cache.get(u'A'), (1.0, 0.5))
+       score_cache.put(u'C', (3.0, 0.5))
+       self.assertIsNone(score_cache.get(u'B'))
+       self.assertEqual((score_cache.hits, score_cache.misses, len(score_cache)), (1, 1, 2))
+       score_cache = decipher.Score_Cache()
+       results = []
+       for cache in [None, score_cache, score_cache]:
+          decipher.random.seed(5)
+          results.append(decipher.decrypt(self.corpus_obj, self.encrypted_text_obj, score_cache=cache))
+       self.assertEqual(results[0], results[1])
+       self.assertEqual(results[0], results[2])
+       self.assertGreater(score_cache.hits, score_cache.misses)
+       # the counters of a run are read from the cache it is given, the run itself does not print them
+       score_cache = decipher.Score_Cache()
+       stdout = sys.stdout
+       sys.stdout = StringIO.StringIO()
+       try:
+          decipher.run_decryption_iterations(self.encrypted_text_obj, self.corpus_obj, tolerance=0.9, seed=7, score_cache=score_cache)
+          output = sys.stdout.getvalue()
+       finally:
+          sys.stdout = stdout
+       self.assertGreater(score_cache.hits, 0)
+       self.assertNotIn('score cache:', output)
+
+   def test_search_trace(self):
+       test_data_dir = build_test_dir_path()
+       decipher.make_dir(test_data_dir)
+       trace_path = os.path.join(test_data_dir, 'trace.jsonl')
+       open(trace_path, 'w').close()
+       trace = decipher.Search_Trace(trace_path)
+       decipher.random.seed(5)
+       untraced = decipher.decrypt(self.corpus_obj, self.encrypted_text_obj)
+       decipher.random.seed(5)
+       self.assertEqual(decipher.decrypt(self.corpus_obj, self.encrypted_text_obj, trace=trace, try_number=1), untraced)
+       records = [json.loads(line) for line in open(trace_path)]
+       self.assertEqual([record['phase'] for record in records], range(len(records)))
+       for record in records:
+          self.assertEqual((record['engine'], record['try']), ('hill_climb', 1))
+          self.assertLessEqual(record['accepted'], record['candidates'])
+          self.assertEqual(record['best_score'], record['trajectory'][-1][1])
+          self.assertEqual(record['trajectory'], sorted(record['trajectory']))
+       self.assertEqual(records[-1]['ratio_of_words_found'], untraced[1])
+       summary = decipher.summarize_trace(trace_path)
+       self.assertEqual(sum(phase_totals['candidates'] for phase_totals in summary), sum(record['candidates'] for record in records))
+
+   def test_search_config(self):
+       test_data_dir = build_test_dir_path()
+       decipher.make_dir(test_data_dir)
+       config_path = os.path.join(test_data_dir, 'search_config.json')
+       decipher.write_json({'max_tries': 2, 'tolerance': 1.0, 'decryption_tests': [[1, 2], [2, 30]]}, config_path)
+       config = decipher.read_search_config(config_path)
+       self.assertEqual(config, decipher.DEFAULT_SEARCH_CONFIG._replace(max_tries=2, tolerance=1.0, decryption_tests=[(1, 2), (2, 30)]))
+       decipher.write_json({'max_restarts': 2}, config_path)
+       self.assertIsNone(decipher.read_search_config(config_path))
+       for bad_config in [{'max_tries': '5'}, {'tolerance': '0.9'}, {'decryption_tests': [[0, 5]]}, {'decryption_tests': [[1, 2], [2]]},
+                          {'decryption_tests': []}, {'time_budget': -1}, {'plateau_evaluations': 1.5}]:
+          decipher.write_json(bad_config, config_path)
+          self.assertIsNone(decipher.read_search_config(config_path))
+       self.assertEqual(decipher.parse_decryption_tests('1:2,2:30,'), [(1, 2), (2, 30)])
+       self.assertIsNone(decipher.parse_decryption_tests('1:2,2'))
+       self.assertIsNone(decipher.parse_decryption_tests('1:x'))
+       self.assertEqual(decipher.parse_number('--time_budget', '0.5', float), 0.5)
+       self.assertRaises(SystemExit, decipher.parse_number, '--max_tries', 'x', int)
+       self.assertIsNotNone(decipher.check_search_config(config._replace(decryption_tests=decipher.parse_decryption_tests('0:0'))))
+       self.assertTrue(decipher.search_budget_spent(100, 10, 100, None))
+       self.assertTrue(decipher.search_budget_spent(100, 10, None, 90))
+       self.assertFalse(decipher.search_budget_spent(100, 20, 200, 90))
+       tries = []
+       decrypt_map = decipher.run_decryption_iterations(self.encrypted_text_obj, self.corpus_obj, seed=7, config=config,
+                                                        progress=lambda try_number, decrypt_map, ratio: tries.append(try_number))
+       self.assertIsNone(decrypt_map)
+       self.assertEqual(tries, [1, 2])
+       tries = []
+       start_time = time.time()
+       decipher.run_decryption_iterations(decipher.Encrypted_Text(None, self.encrypted_text_obj.raw_text * 20), self.corpus_obj, backend='full',
+                                          config=config._replace(max_tries=200, time_budget=0.2),
+                                          progress=lambda try_number, decrypt_map, ratio: tries.append(try_number))
+       self.assertLess(time.time() - start_time, 2)
+       self.assertEqual(tries, [1])
+       trace_path = os.path.join(test_data_dir, 'trace.jsonl')
+       for engine in decipher.SEARCH_ENGINES:
+          open(trace_path, 'w').close()
+          decipher.SEARCH_ENGINES[engine](self.corpus_obj, self.encrypted_text_obj, trace=decipher.Search_Trace(trace_path), max_evaluations=150)
+          self.assertEqual(sum(json.loads(line)['candidates'] for line in open(trace_path)), 150)
+
+   def test_corpus_cache(self):
+       test_data_dir = build_test_dir_path()
+       decipher.make_dir(test_data_dir)
+       cache_path = os.path.join(test_data_dir, 'corpus_cache.bin')
+       self.assertTrue(decipher.write_corpus_cache(self.corpus_obj, cache_path))
+       cached_corpus_obj = decipher.Corpus(self.corpus_obj.filepath, use_cache = True, cache_path = cache_path)
+       self.assertEqual(dict(cached_corpus_obj.corpus_dict.iteritems()), self.corpus_obj.corpus_dict)
+       self.assertEqual(dict(cached_corpus_obj.trigrams.iteritems()), dict(self.corpus_obj.trigrams))
+       self.assertEqual(cached_corpus_obj.letters_by_frequency, self.corpus_obj.letters_by_frequency)
+       self.assertEqual(cached_corpus_obj.score_one_word(u'FORK'), self.corpus_obj.score_one_word(u'FORK'))
+       self.assertFalse(cached_corpus_obj.corpus_dict.has_key(u'FORKS'))
+       # without a cache path nothing is read from or written to a shared cache file
+       uncached_corpus_obj = decipher.Corpus(self.corpus_obj.filepath, use_cache = True)
+       self.assertIsNone(uncached_corpus_obj.corpus_cache)
+       self.assertEqual(uncached_corpus_obj.corpus_dict, self.corpus_obj.corpus_dict)
+       self.assertIsNone(cached_corpus_obj.word_patterns)
+       self.assertEqual(cached_corpus_obj.build_word_patterns()[u'ABCA'], self.corpus_obj.build_word_patterns()[u'ABCA'])
+       self.assertEqual(len(cached_corpus_obj.build_word_patterns()), len(self.corpus_obj.build_word_patterns()))
+       self.assertEqual(cached_corpus_obj.build_words_by_length().get(4, None, 5), self.corpus_obj.build_words_by_length().get(4, None, 5))
+       self.assertEqual(decipher.build_decryption_tests(cached_corpus_obj, self.encrypted_text_obj, decipher.DECRYPTION_TESTS),
+                        decipher.build_decryption_tests(self.corpus_obj, self.encrypted_text_obj, decipher.DECRYPTION_TESTS))
+       self.assertEqual(cached_corpus_obj.trigrams[u'QQQ'], 0)
+       self.assertEqual(cached_corpus_obj.build_fingerprint(), self.corpus_obj.build_fingerprint())
+
+   def test_corpus_registry(self):
+       test_data_dir = build_test_dir_path()
+       decipher.make_dir(test_data_dir)
+       registry = decipher.Corpus_Registry(os.path.join(test_data_dir, 'corpus_cache'))
+       self.assertIsNone(registry.load(self.corpus_obj.filepath).corpus_cache)
+       cached_corpus_obj = registry.load(self.corpus_obj.filepath)
+       self.assertIsNotNone(cached_corpus_obj.corpus_cache)
+       self.assertEqual(dict(cached_corpus_obj.corpus_dict.iteritems()), self.corpus_obj.corpus_dict)
+       self.assertNotEqual(registry.cache_path(self.corpus_obj.filepath, 4), registry.cache_path(self.corpus_obj.filepath))
+       changed_corpus_path = os.path.join(test_data_dir, 'changed_quotes.txt')
+       with open(changed_corpus_path, 'wb') as changed_corpus_file:
+          changed_corpus_file.write(open(self.corpus_obj.filepath, 'rb').read() + '\nForks everywhere\n')
+       self.assertNotEqual(registry.cache_path(changed_corpus_path), registry.cache_path(self.corpus_obj.filepath))
+       # the digest is read from the index while the file is unchanged, and computed again once it changes
+       self.assertEqual(registry.file_digest(changed_corpus_path), decipher.corpus_file_digest(changed_corpus_path))
+       corpus_file_digest = decipher.corpus_file_digest
+       hashed_paths = []
+       decipher.corpus_file_digest = lambda filepath: hashed_paths.append(filepath) or corpus_file_digest(filepath)
+       try:
+          registry.cache_path(changed_corpus_path)
+       finally:
+          decipher.corpus_file_digest = corpus_file_digest
+       self.assertEqual(hashed_paths, [])
+       with open(changed_corpus_path, 'ab') as changed_corpus_file:
+          changed_corpus_file.write('Forks\n')
+       self.assertEqual(registry.file_digest(changed_corpus_path), decipher.corpus_file_digest(changed_corpus_path))
+       first_cache_path = registry.cache_path(self.corpus_obj.filepath)
+       registry.max_bytes = os.path.getsize(first_cache_path)
+       changed_corpus_obj = registry.load(changed_corpus_path)
+       self.assertEqual(changed_corpus_obj.corpus_dict[u'EVERYWHERE'], 1)
+       self.assertFalse(os.path.exists(first_cache_path))
+       # temporary files of failed writes are removed once they are stale
+       stale_path = os.path.join(registry.directory, 'stale.bin.1.tmp')
+       fresh_path = os.path.join(registry.directory, 'fresh.bin.2.tmp')
+       open(stale_path, 'w').close()
+       open(fresh_path, 'w').close()
+       stale_time = time.time() - decipher.STALE_TEMPORARY_SECONDS - 1
+       os.utime(stale_path, (stale_time, stale_time))
+       registry.max_bytes = decipher.CORPUS_CACHE_MAX_BYTES
+       self.assertEqual(registry.evict(), [stale_path])
+       self.assertTrue(os.path.exists(fresh_path))
+       # a cache that cannot be renamed into place, here over a directory, leaves no temporary file behind
+       directory_path = os.path.join(test_data_dir, 'directory.bin')
+       decipher.make_dir(directory_path)
+       self.assertFalse(decipher.write_corpus_cache(self.corpus_obj, directory_path))
+       self.assertEqual(glob.glob(directory_path + '*.tmp'), [])
+       self.assertTrue(os.path.exists(registry.cache_path(changed_corpus_path)))
+
+   def test_rank_corpora(self):
+       fingerprint = decipher.build_fingerprint(Counter(self.encrypted_text_obj.list_of_strings))
+       self.assertAlmostEqual(sum(fingerprint.letter_profile), 1.0)
+       self.assertEqual(fingerprint.letter_profile, sorted(fingerprint.letter_profile, reverse=True))
+       decrypt_map = decipher.build_decrypt_map(self.cypher_key_alphabet_list, self.corpus_alphabet_list)
+       self.assertEqual(decipher.build_fingerprint(Counter(word.translate(decrypt_map) for word in self.encrypted_text_obj.list_of_strings)), fingerprint)
+       test_data_dir = build_test_dir_path()
+       decipher.make_dir(test_data_dir)
+       other_corpus_path = os.path.join(test_data_dir, 'other_corpus.txt')
+       rng = random.Random(1)
+       with open(other_corpus_path, 'w') as other_corpus_file:
+          other_corpus_file.write(' '.join(''.join(rng.choice('AEIOUXYZ') for i in range(rng.randint(6, 12))) for w in range(500)))
+       corpora = {'quotes': self.corpus_obj, 'other': decipher.Corpus(other_corpus_path, cache_path = None)}
+       ranking = decipher.rank_corpora(self.encrypted_text_obj, corpora)
+       self.assertEqual([name for distance, name in ranking], ['quotes', 'other'])
+       self.assertLess(ranking[0][0], ranking[1][0])
+       # a corpus file is one corpus, a file listing existing files is a manifest
+       self.assertEqual(decipher.find_corpus_files(other_corpus_path), [other_corpus_path])
+       manifest_path = os.path.join(test_data_dir, 'corpora.txt')
+       decipher.write_file(u'other_corpus.txt\n', manifest_path, encoding='utf-8')
+       self.assertEqual(decipher.find_corpus_files(manifest_path), [other_corpus_path])
+       self.assertEqual(decipher.find_corpus_files(os.path.join(test_data_dir, 'nomatch*.txt')), [])
+
+   def test_streamed_corpus(self):
+       whole_corpus_obj = decipher.Corpus(self.corpus_obj.filepath, cache_path = None, keep_text = True)
+       self.assertTrue(whole_corpus_obj.raw_text.startswith(u'When you come to a fork'))
+       for chunk_size in [5, 64, 4096, None]:
+          streamed_corpus_obj = decipher.Corpus(self.corpus_obj.filepath, cache_path = None, chunk_size = chunk_size)
+          self.assertEqual(streamed_corpus_obj.corpus_dict, whole_corpus_obj.corpus_dict)
+          self.assertEqual(streamed_corpus_obj.trigrams, whole_corpus_obj.trigrams)
+          self.assertEqual(streamed_corpus_obj.letters_by_frequency, whole_corpus_obj.letters_by_frequency)
+          self.assertEqual(streamed_corpus_obj.raw_text, None)
+
+   def test_parallel_corpus_build(self):
+       whole_corpus_obj = decipher.Corpus(self.corpus_obj.filepath, cache_path = None, keep_text = True)
+       parallel_corpus_obj = decipher.Corpus(self.corpus_obj.filepath, cache_path = None, chunk_size = 64, build_workers = 3)
+       self.assertEqual(parallel_corpus_obj.corpus_dict, whole_corpus_obj.corpus_dict)
+       self.assertEqual(parallel_corpus_obj.trigrams, whole_corpus_obj.trigrams)
+       self.assertEqual(parallel_corpus_obj.letters_by_frequency, whole_corpus_obj.letters_by_frequency)
+
+   def test_find_shard_boundaries(self):
+       boundaries = decipher.find_shard_boundaries(self.corpus_obj.filepath, 4)
+       self.assertEqual(boundaries[0], 0)
+       self.assertEqual(boundaries[-1], os.path.getsize(self.corpus_obj.filepath))
+       self.assertEqual(boundaries, sorted(set(boundaries)))
+
+   def test_choose_swap(self):
+       random.seed(2)
+       base_list = ['b', 'c', 'd', 'e','a']
+       index1, index2 = decipher.choose_swap(base_list, ['a'], ['d','e'])
+       self.assertEqual(index1, 4)
+       self.assertTrue(index2 in [2, 3])
+       swap_sampler = decipher.Swap_Sampler(base_list, ['a', 'ab'], None)
+       self.assertEqual(sorted(swap_sampler.indexes1), [0, 4])
+       self.assertEqual(swap_sampler.indexes2, range(5))
+       random.seed(3)
+       swaps = [decipher.choose_swap(base_list, ['ab'], ['de']) for i in range(10)]
+       random.seed(3)
+       swap_sampler = decipher.Swap_Sampler(base_list, ['ab'], ['de'])
+       self.assertEqual([swap_sampler.sample() for i in range(10)], swaps)
+
+
+class TestBenchmarkMethods(unittest.TestCase):
+   def test_run_benchmarks(self):
+       corpus_path = os.path.join(decipher.data_directory,'tests','test_quotes.txt')
+       encrypted_paths = benchmark.find_encrypted_files(corpus_path + '-*')
+       self.assertEqual(len(encrypted_paths), 4)
+       encrypted_text = benchmark.encrypt_text(u'Take it.', 1)
+       self.assertEqual(len(encrypted_text), 8)
+       self.assertEqual(encrypted_text[-1], u'.')
+       results = benchmark.run_benchmarks(corpus_path, encrypted_paths[:1], [1000], repeat=1)
+       names = [result['name'] for result in results['benchmarks']]
+       self.assertEqual(names, ['corpus_build', 'corpus_cache_load', 'normalize_text', 'divide_ngrams', 'score_decryption',
+                                'incremental_score_swap', 'solve test_quotes.txt-123', 'solve synthetic 1000'])
+       self.assertTrue(all(result['peak_memory_kb'] >= 0 for result in results['benchmarks']))
+       # each benchmark reports the memory it adds, not that of the benchmarks before it or of the parent process
+       held_text = 'a' * 64 * 1024 * 1024
+       large_result = benchmark.run_forked(lambda: benchmark.build_result('large', len('b' * 64 * 1024 * 1024)))
+       small_result = benchmark.run_forked(lambda: benchmark.build_result('small', len(held_text)))
+       self.assertGreater(large_result['peak_memory_kb'], 32 * 1024)
+       self.assertLess(small_result['peak_memory_kb'], 32 * 1024)
+       self.assertGreater(results['benchmarks'][4]['keys_per_second'], 0)
+       self.assertIsNotNone(results['benchmarks'][6]['time_to_solve'])
+       json.dumps(results)
+
+class TestServerMethods(unittest.TestCase):
+   def setUp(self):
+       corpus_obj = decipher.Corpus(os.path.join(decipher.data_directory,'tests','test_quotes.txt'), cache_path = None)
+       self.server = server.build_server({'quotes': corpus_obj}, ('127.0.0.1', 0), workers=2)
+       self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+       self.thread = threading.Thread(target=self.server.serve_forever)
+       self.thread.start()
+
+   def tearDown(self):
+       self.server.shutdown()
+       self.server.server_close()
+       self.thread.join()
+
+   def post(self, request):
+       try:
+          response = urllib2.urlopen(self.url + '/decrypt', json.dumps(request))
+       except urllib2.HTTPError as error:
+          response = error
+       return response.getcode(), json.loads(response.read())
+
+   def test_decrypt_request(self):
+       self.assertEqual(json.loads(urllib2.urlopen(self.url + '/corpora').read()), {'corpora': ['quotes']})
+       encrypted_text = decipher.read_textfile(os.path.join(decipher.data_directory,'tests','test_quotes.txt-123'))
+       status, response = self.post({'text': encrypted_text, 'seed': 7, 'tolerance': 0.9})
+       self.assertEqual(status, 200)
+       self.assertTrue(response['plaintext'].startswith(u'When you come to a fork in the road'))
+       self.assertGreater(response['ratio_of_words_found'], 0.9)
+       self.assertEqual(len(response['decrypt_map']), 26)
+       self.assertEqual(response['corpus'], 'quotes')
+       self.assertEqual(self.post({'text': encrypted_text, 'corpus': 'other'})[0], 400)
+       self.assertEqual(self.post({'corpus': 'quotes'})[0], 400)
+       self.assertEqual(self.post({'text': encrypted_text, 'tolerance': '0.9'})[0], 400)
+       self.assertEqual(self.post({'text': encrypted_text, 'seed': 'x'})[0], 400)
+       for bad_values in [{'tolerance': True}, {'tolerance': 1.5}, {'time_budget': False}, {'time_budget': -1}, {'seed': True}, {'seed': 1.5}]:
+          bad_values['text'] = encrypted_text
+          self.assertEqual(self.post(bad_values)[0], 400)
+       status, response = self.post({'text': encrypted_text, 'seed': 7, 'tolerance': 1.0, 'time_budget': 0.5})
+       self.assertEqual(status, 200)
+       self.assertTrue(response['plaintext'].startswith(u'When you come to a fork in the road'))
 
 if __name__ == '__main__':
    setup()